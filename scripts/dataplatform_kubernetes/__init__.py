@@ -10,7 +10,8 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(logging.StreamHandler(sys.stdout))
 LOGGER.setLevel(int(os.getenv("LOGGING_LEVEL", logging.INFO)))
 
-BASE_DIR: Path = Path(__file__).parents[2]
+BASE_DIR_ENV = "DP_BASE_DIR"
+BASE_DIR: Path = Path(os.getenv(BASE_DIR_ENV) or Path(__file__).parents[2]).resolve()
 
 ENVIRONMENT_DEV = "dev"
 ENVIRONMENT_PROD = "prod"
@@ -29,14 +30,31 @@ CLOUDSQL_KINDS = [
 CUE_COMMAND = "cue"
 CUE_COMMAND_CMD = "cmd"
 CUE_COMMAND_DUMP = "dump"
+CUE_COMMAND_DUMP_BATCH = "dump_batch"
 CUE_COMMAND_AVRO_AVDL = "avdl"
 CUE_COMMAND_AVRO_AVSC = "avsc"
 CUE_COMMAND_EVAL = "eval"
-CUE_SCRIPTS_DIR = Path(__file__).parents[1]
+CUE_SCRIPTS_DIR = BASE_DIR / "scripts"
 CUE_CLI_TOOL_FILE = "cli_tool.cue"
 CUE_AVRO_TOOL_FILE = "avro_tool.cue"
 CUE_DELIVERY_FILE = "delivery.cue"
+CUE_BATCH_TOOL_TEMPLATE = "batch_tool.cue.jinja2"
 AVRO_AVDL_FILE = "*.avdl"
+AVRO_AVSC_FILE = "*.avsc"
+AVRO_TOOLS_JAR = "./avro-tools.jar"
+AVRO_IDL_BATCH_SOURCE = CUE_SCRIPTS_DIR / "resources" / "avro" / "IdlBatch.java"
+JAVA_COMMAND = "java"
+CUE_MODULE_PATH = "github.com/kouzoh/dataplatform-kubernetes"
+CUE_MODULE_DIR = BASE_DIR / "cue.mod"
+CUE_MANIFESTS_DIR = BASE_DIR / "manifests"
+CUE_PKG_DIR = BASE_DIR / "pkg"
+
+CUE_CACHE_DIR = BASE_DIR / ".cache" / "cue"
+CUE_CACHE_MAX_SIZE = 512 * 1024 * 1024
+CUE_STATS_FILE = BASE_DIR / ".cache" / "cue-stats.json"
+CUE_UPLOAD_LEDGER_DIR = BASE_DIR / ".cache" / "upload"
+
+BQ_SCHEMA_HISTORY_JOURNAL_DIR = BASE_DIR / ".cache" / "bigquery"
 
 
 @dataclass
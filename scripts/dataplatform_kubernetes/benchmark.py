@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import click
+from dataplatform_kubernetes import (
+    BASE_DIR,
+    BASE_DIR_ENV,
+    CUE_AVRO_TOOL_FILE,
+    CUE_CLI_TOOL_FILE,
+    CUE_MANIFESTS_DIR,
+    CUE_SCRIPTS_DIR,
+    ENVIRONMENT_DEV,
+    ContextArgument,
+)
+from dataplatform_kubernetes.cue import (
+    _build_avro_avsc_command,
+    _build_avro_idl_batch_command,
+    _build_dump_batch_tool,
+    _build_dump_command,
+    dump,
+)
+from dataplatform_kubernetes.deps import DependencyIndex
+from dataplatform_kubernetes.scaffold import (
+    ScaffoldBeyondConfig,
+    ScaffoldCloudSqlConfig,
+    ScaffoldSpannerConfig,
+    _generate_beyond_cue_files,
+    _generate_cloudsql_cue_files,
+    _generate_metadata_cue_files,
+    _generate_spanner_cue_files,
+    _get_env_dir,
+    _make_pkg_dir,
+    _update_codeowners,
+)
+from dataplatform_kubernetes.util import (
+    get_changed_avro_files,
+    get_changed_cue_dir,
+    get_changed_dir,
+)
+
+BENCHMARK_SIZES = [10, 100, 1000]
+BENCHMARK_RESOURCE_DIR = CUE_SCRIPTS_DIR / "resources" / "benchmark"
+BENCHMARK_EXECUTABLES = ["cue", "java"]
+BENCHMARK_LATENCY_ENV = "DP_BENCHMARK_LATENCY"
+BENCHMARK_AVRO_EVERY = 10
+STARTUP_COMMANDS = {
+    "cue": ["cue", "dump", "--help"],
+    "scaffold": ["scaffold", "spanner", "--help"],
+}
+STARTUP_SCRIPT = "import sys; from dataplatform_kubernetes.cli import cli; cli(sys.argv[1:])"
+STARTUP_FORBIDDEN_MODULES = [
+    "github",
+    "google.cloud.bigquery",
+    "google.cloud.secretmanager",
+    "slack_sdk",
+]
+STARTUP_SLOWEST_MODULES = 10
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(?P<self>[0-9]+) \|\s+[0-9]+ \| (?P<module>.+)$")
+BENCHMARK_AVDL = """protocol Event {
+  record Event {
+    string id;
+    long timestamp;
+  }
+}
+"""
+
+
+def _prepare_root(root: Path) -> Path:
+    # Reuse the cue tools and templates of the real tree, everything else is synthetic.
+    scripts_dir = root / "scripts"
+    scripts_dir.mkdir(parents=True)
+    for name in [CUE_CLI_TOOL_FILE, CUE_AVRO_TOOL_FILE]:
+        shutil.copy(CUE_SCRIPTS_DIR / name, scripts_dir / name)
+    (scripts_dir / "resources").symlink_to(CUE_SCRIPTS_DIR / "resources")
+    (root / ".github").mkdir()
+    (root / ".github" / "CODEOWNERS").touch()
+    bin_dir = root / "bin"
+    bin_dir.mkdir()
+    for name in BENCHMARK_EXECUTABLES:
+        shutil.copy(BENCHMARK_RESOURCE_DIR / name, bin_dir / name)
+    return bin_dir
+
+
+def _scaffold_services(services: int) -> None:
+    for i in range(services):
+        service_id = f"service-{i:04d}"
+        short_service_id = f"svc{i:04d}"
+        kind = i % 3
+        config: Any
+        if kind == 0:
+            config = ScaffoldSpannerConfig(
+                ENVIRONMENT_DEV,
+                service_id,
+                short_service_id,
+                f"{service_id}-dev",
+                "instance",
+                "database",
+                "#benchmark",
+            )
+            _generate_metadata_cue_files(config)
+            _generate_spanner_cue_files(config)
+        elif kind == 1:
+            config = ScaffoldCloudSqlConfig(
+                ENVIRONMENT_DEV,
+                service_id,
+                short_service_id,
+                "123456789",
+                "mysql",
+                "asia-northeast1",
+                f"{service_id}-dev",
+                "instance",
+                "database",
+                "#benchmark",
+            )
+            _generate_metadata_cue_files(config)
+            _generate_cloudsql_cue_files(config)
+        else:
+            config = ScaffoldBeyondConfig(
+                ENVIRONMENT_DEV,
+                service_id,
+                short_service_id,
+                "instance",
+                "database",
+                "#benchmark",
+            )
+            _generate_metadata_cue_files(config)
+            _generate_beyond_cue_files(config)
+        if i % BENCHMARK_AVRO_EVERY == 0:
+            avro_dir = _get_env_dir(config) / "avro"
+            avro_dir.mkdir(parents=True, exist_ok=True)
+            (avro_dir / "event.avdl").write_text(BENCHMARK_AVDL, encoding="utf-8")
+        _update_codeowners(service_id, "benchmark")
+        _make_pkg_dir(service_id)
+
+
+def _detect_changes(files: List[Path]) -> Tuple[Any, Any]:
+    changed_dir = get_changed_dir(files)
+    return get_changed_cue_dir(changed_dir), get_changed_avro_files(changed_dir)
+
+
+def _build_index(files: List[Path]) -> Any:
+    index = DependencyIndex.build()
+    return index, index.affected_delivery_dirs(files)
+
+
+def _build_commands(cue_dirs: List[Path], avro_files: List[Path], index: Any) -> None:
+    for d in cue_dirs:
+        _build_dump_command(d)
+    _build_dump_batch_tool(cue_dirs, index)
+    _build_avro_idl_batch_command(avro_files, "avro-tools.jar")
+    for f in avro_files:
+        _build_avro_avsc_command(f)
+
+
+def _dump(args: List[str]) -> None:
+    with open(os.devnull, "wt") as devnull, contextlib.redirect_stdout(devnull):
+        dump.main(args=args, standalone_mode=False, obj=ContextArgument())
+
+
+def _timed(phases: Dict[str, float], name: str, fn: Callable[..., Any], *args: Any) -> Any:
+    start = time.perf_counter()
+    result = fn(*args)
+    phases[name] = time.perf_counter() - start
+    return result
+
+
+def _measure(services: int, max_worker: Optional[int]) -> Dict[str, float]:
+    phases: Dict[str, float] = {}
+    _timed(phases, "scaffold", _scaffold_services, services)
+    files = sorted(CUE_MANIFESTS_DIR.rglob("*.cue"))
+    cue_dirs, avro_files = _timed(phases, "change_detection", _detect_changes, files)
+    index, _ = _timed(phases, "dependency_index", _build_index, files)
+    _timed(phases, "command_build", _build_commands, sorted(cue_dirs), sorted(avro_files), index)
+
+    stats_file = BASE_DIR / ".cache" / "stats.json"
+    cache_dir = BASE_DIR / ".cache" / "cue"
+    common = ["--stats-file", str(stats_file), "--avro-tools", "avro-tools.jar"]
+    if max_worker:
+        common.extend(["--max-worker", str(max_worker)])
+    manifests = str(CUE_MANIFESTS_DIR)
+    _timed(phases, "dump", _dump, [*common, "--no-cache", "--no-batch", manifests])
+    _timed(phases, "dump_batch", _dump, [*common, "--no-cache", "--batch", manifests])
+    cached = [*common, "--cache", "--cache-dir", str(cache_dir), "--batch", manifests]
+    _timed(phases, "dump_cache_cold", _dump, cached)
+    _timed(phases, "dump_cache_warm", _dump, cached)
+    return phases
+
+
+def _run_size(services: int, latency: float, max_worker: Optional[int]) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory(prefix="dp-benchmark-") as tmp:
+        root = Path(tmp).resolve()
+        bin_dir = _prepare_root(root)
+        output = root / "phases.json"
+        env = dict(os.environ)
+        env[BASE_DIR_ENV] = str(root)
+        env[BENCHMARK_LATENCY_ENV] = str(latency)
+        env["PATH"] = os.pathsep.join([str(bin_dir), env.get("PATH", "")])
+        env["PYTHONPATH"] = os.pathsep.join(
+            [str(Path(__file__).parents[1]), env.get("PYTHONPATH", "")]
+        )
+        cmd = [sys.executable, "-m", "dataplatform_kubernetes.benchmark", "measure"]
+        cmd.extend([str(services), str(output)])
+        if max_worker:
+            cmd.extend(["--max-worker", str(max_worker)])
+        proc = subprocess.run(cmd, cwd=root, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            click.echo(proc.stdout[-4000:], err=True)
+            click.echo(proc.stderr[-4000:], err=True)
+            raise RuntimeError(f"Benchmark failed with {services} services.")
+        with output.open("rt", encoding="utf-8") as f:
+            phases: Dict[str, float] = json.load(f)
+        return phases
+
+
+def _measure_startup(args: List[str], repeat: int) -> Tuple[float, Dict[str, int]]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(Path(__file__).parents[1]), env.get("PYTHONPATH", "")])
+    cmd = [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT, *args]
+    wall_time = float("inf")
+    modules: Dict[str, int] = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        wall_time = min(wall_time, time.perf_counter() - start)
+        if proc.returncode != 0:
+            click.echo(proc.stderr[-4000:], err=True)
+            raise RuntimeError(f"Startup benchmark failed: dp {' '.join(args)}")
+        modules = {}
+        for line in proc.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            match = IMPORT_TIME_PATTERN.match(line)
+            if match:
+                modules[match.group("module").strip()] = int(match.group("self"))
+    return wall_time, modules
+
+
+def _forbidden_modules(modules: Iterable[str]) -> List[str]:
+    return sorted(
+        m
+        for m in modules
+        if any(m == f or m.startswith(f"{f}.") for f in STARTUP_FORBIDDEN_MODULES)
+    )
+
+
+def _compare(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], threshold: float
+) -> List[str]:
+    previous = {(r.get("services"), r["phase"]): r["seconds"] for r in baseline}
+    regressions = []
+    for r in results:
+        services = r.get("services")
+        label = f"{services if services is not None else '-':>6} {r['phase']:<20}"
+        before = previous.get((services, r["phase"]))
+        if not before:
+            click.echo(f"{label} {r['seconds']:10.3f}s", err=True)
+            continue
+        ratio = r["seconds"] / before
+        line = f"{label} {r['seconds']:10.3f}s {ratio:7.2f}x"
+        if ratio > 1 + threshold:
+            line += " REGRESSION"
+            regressions.append(r["phase"] if services is None else f"{r['phase']} with {services}")
+        click.echo(line, err=True)
+    return regressions
+
+
+def _write_report(
+    output: Path,
+    results: List[Dict[str, Any]],
+    baseline: Optional[Path],
+    threshold: float,
+    **extra: Any,
+) -> List[str]:
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        **extra,
+        "results": results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("wt", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    previous = []
+    if baseline:
+        with baseline.open("rt", encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+    return _compare(results, previous, threshold)
+
+
+@click.group()
+def benchmark() -> None:
+    pass
+
+
+@benchmark.command()
+@click.option(
+    "--services",
+    type=int,
+    multiple=True,
+    default=BENCHMARK_SIZES,
+    show_default=True,
+    help="Number of synthetic microservices, repeatable",
+)
+@click.option(
+    "--latency", type=float, default=0.01, show_default=True, help="Seconds per fake cue/java run"
+)
+@click.option("--max-worker", type=int, default=None, help="Defaults to the number of CPUs")
+@click.option(
+    "--output",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True, path_type=Path),
+    default="benchmark.json",
+    show_default=True,
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, path_type=Path),
+    required=False,
+    help="Results of a previous run to compare against",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="Allowed slowdown against the baseline",
+)
+def run(
+    services: List[int],
+    latency: float,
+    max_worker: Optional[int],
+    output: Path,
+    baseline: Optional[Path],
+    threshold: float,
+) -> None:
+    results = []
+    for n in services:
+        click.echo(f"benchmark: {n} services", err=True)
+        for phase, seconds in _run_size(n, latency, max_worker).items():
+            results.append({"services": n, "phase": phase, "seconds": seconds})
+    regressions = _write_report(
+        output, results, baseline, threshold, latency=latency, max_worker=max_worker
+    )
+    if regressions:
+        raise RuntimeError(f"Benchmark regressions: {regressions}")
+
+
+@benchmark.command()
+@click.option("--repeat", type=int, default=5, show_default=True, help="Best of N runs")
+@click.option(
+    "--output",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True, path_type=Path),
+    default="benchmark-startup.json",
+    show_default=True,
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, path_type=Path),
+    required=False,
+    help="Results of a previous run to compare against",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="Allowed slowdown against the baseline",
+)
+def startup(repeat: int, output: Path, baseline: Optional[Path], threshold: float) -> None:
+    results = []
+    forbidden = {}
+    for name, args in STARTUP_COMMANDS.items():
+        wall_time, modules = _measure_startup(args, repeat)
+        results.append({"phase": f"startup:{name}", "seconds": wall_time})
+        results.append({"phase": f"import:{name}", "seconds": sum(modules.values()) / 1e6})
+        slowest = sorted(modules.items(), key=lambda m: -m[1])[:STARTUP_SLOWEST_MODULES]
+        click.echo(f"dp {' '.join(args)}: {len(modules)} modules, slowest:", err=True)
+        for module, us in slowest:
+            click.echo(f"  {us / 1000:8.1f}ms {module}", err=True)
+        if _forbidden_modules(modules):
+            forbidden[name] = _forbidden_modules(modules)
+    regressions = _write_report(output, results, baseline, threshold, repeat=repeat)
+    if forbidden:
+        raise RuntimeError(f"Heavy modules imported at startup: {forbidden}")
+    if regressions:
+        raise RuntimeError(f"Startup regressions: {regressions}")
+
+
+@benchmark.command(hidden=True)
+@click.argument("services", type=int)
+@click.argument("output", type=click.Path(path_type=Path))
+@click.option("--max-worker", type=int, default=None)
+def measure(services: int, output: Path, max_worker: Optional[int]) -> None:
+    phases = _measure(services, max_worker)
+    with output.open("wt", encoding="utf-8") as f:
+        json.dump(phases, f, indent=2)
+
+
+if __name__ == "__main__":
+    benchmark()
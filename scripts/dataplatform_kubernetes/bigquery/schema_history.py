@@ -4,19 +4,54 @@ from __future__ import annotations
 
 import contextlib
 import hashlib
+import json
+import os
 import re
+import threading
 import time
 import traceback
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Iterator, List, Optional, cast
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, cast
 
-from dataplatform_kubernetes import LOGGER, slack
+from dataplatform_kubernetes import BQ_SCHEMA_HISTORY_JOURNAL_DIR, LOGGER, slack
+from dataplatform_kubernetes.scheduler import Job, run_jobs
+from google.api_core.exceptions import NotFound
 from google.cloud.bigquery import Client, SchemaField, Table, dbapi
 from google.cloud.bigquery.job import QueryJobConfig
 
 MIGRATION_FILE_PATTERN = re.compile(r"V(?P<version>[0-9]+)__(?P<description>.+)\.sql")
+HISTORY_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+HISTORY_COLUMNS = (
+    "installed_rank",
+    "version",
+    "description",
+    "script",
+    "checksum",
+    "installed_on",
+    "execution_time",
+    "success",
+)
+
+SQL_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+WRITE_STATEMENT_PATTERN = re.compile(
+    r"\s*(?:CREATE\s+(?:OR\s+REPLACE\s+)?(?:(?:TEMP|TEMPORARY|EXTERNAL|SNAPSHOT)\s+)?"
+    r"(?:MATERIALIZED\s+VIEW|TABLE|VIEW)(?:\s+IF\s+NOT\s+EXISTS)?"
+    r"|ALTER\s+(?:MATERIALIZED\s+VIEW|TABLE|VIEW)(?:\s+IF\s+EXISTS)?"
+    r"|DROP\s+(?:(?:EXTERNAL|SNAPSHOT)\s+)?(?:MATERIALIZED\s+VIEW|TABLE|VIEW)(?:\s+IF\s+EXISTS)?"
+    r"|TRUNCATE\s+TABLE|INSERT(?:\s+INTO)?|DELETE(?:\s+FROM)?|UPDATE|MERGE(?:\s+INTO)?)"
+    r"\s+(?P<name>[\w.`-]+)",
+    re.IGNORECASE,
+)
+READ_TABLE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN|CLONE|COPY|LIKE|USING)\s+(?P<name>[\w.`-]+)", re.IGNORECASE
+)
+RENAME_TABLE_PATTERN = re.compile(r"\bRENAME\s+TO\s+(?P<name>[\w.`-]+)", re.IGNORECASE)
+CREATE_STATEMENT_PATTERN = re.compile(r"\s*CREATE\s", re.IGNORECASE)
+NOT_FOUND_TABLE_PATTERN = re.compile(r"Not found: (?:Table|View) (?P<name>[\w.:`-]+)")
+
+HistoryRow = Tuple[Any, ...]
 
 
 @dataclass
@@ -26,6 +61,7 @@ class SchemaMigrationConfig:
     description: str
     checksum: str
     queries: List[str]
+    script_query: str
 
     @staticmethod
     def calc_checksum(file: Path) -> str:
@@ -50,6 +86,7 @@ class SchemaMigrationConfig:
             description,
             SchemaMigrationConfig.calc_checksum(file),
             [q.strip() for q in query.split(";") if q.strip()],
+            query.strip(),
         )
 
     @property
@@ -57,9 +94,135 @@ class SchemaMigrationConfig:
         return datetime.utcnow()
 
 
+def _table_key(name: str) -> Optional[str]:
+    # dataset.table, so that names with and without the project refer to the same table.
+    parts = name.replace("`", "").lower().split(".")
+    if len(parts) < 2 or not all(parts):
+        return None
+    return ".".join(parts[-2:])
+
+
+def statement_target(query: str) -> Optional[str]:
+    # Table written by the statement, None if the statement is not understood.
+    match = WRITE_STATEMENT_PATTERN.match(SQL_COMMENT_PATTERN.sub(" ", query))
+    return _table_key(match.group("name")) if match else None
+
+
+def renamed_table(query: str, table: str) -> Optional[str]:
+    # New name of a table renamed by the statement, in the dataset of the old name.
+    match = RENAME_TABLE_PATTERN.search(SQL_COMMENT_PATTERN.sub(" ", query))
+    if not match:
+        return None
+    name = match.group("name")
+    return _table_key(name if "." in name else f"{table.split('.')[0]}.{name}")
+
+
+def created_table(query: str) -> Optional[str]:
+    # Table created by the statement, None if it does not create one.
+    table = statement_target(query)
+    if table is None:
+        return None
+    if CREATE_STATEMENT_PATTERN.match(SQL_COMMENT_PATTERN.sub(" ", query)):
+        return table
+    return renamed_table(query, table)
+
+
+def not_found_table(message: str) -> Optional[str]:
+    # BigQuery names missing tables as project:dataset.table.
+    match = NOT_FOUND_TABLE_PATTERN.search(message)
+    return _table_key(match.group("name").replace(":", ".")) if match else None
+
+
+def migration_targets(migration: SchemaMigrationConfig) -> Optional[Set[str]]:
+    # Tables written or read by the migration, None if any statement is not understood.
+    targets = set()
+    for q in migration.queries:
+        table = statement_target(q)
+        if table is None:
+            return None
+        targets.add(table)
+        renamed = renamed_table(q, table)
+        if renamed is not None:
+            targets.add(renamed)
+        q = SQL_COMMENT_PATTERN.sub(" ", q)
+        for read in READ_TABLE_PATTERN.finditer(q):
+            # Single part names are CTEs, UNNEST and the like.
+            table = _table_key(read.group("name"))
+            if table is not None:
+                targets.add(table)
+    return targets
+
+
+def plan_migrations(migrations: List[SchemaMigrationConfig]) -> Dict[str, List[str]]:
+    # Migrations sharing a table keep their version order. A migration with unknown targets is a
+    # barrier: it waits for every migration before it and every migration after it waits for it.
+    depends: Dict[str, List[str]] = {}
+    last: Dict[str, str] = {}
+    barrier: Optional[str] = None
+    since_barrier: List[str] = []
+    for m in migrations:
+        targets = migration_targets(m)
+        if targets is None:
+            depends[m.script] = since_barrier or ([barrier] if barrier else [])
+            barrier = m.script
+            since_barrier = []
+            last = {}
+            continue
+        deps = {last[t] for t in targets if t in last}
+        if barrier and not deps:
+            deps.add(barrier)
+        depends[m.script] = sorted(deps)
+        last.update({t: m.script for t in targets})
+        since_barrier.append(m.script)
+    return depends
+
+
+class SchemaHistoryJournal:
+    # History rows of migrations that already ran but are not written to BigQuery yet. A row
+    # is synced to disk before it is buffered, so a crashed run can replay it on the next run.
+    # CI carries it over to the next run with actions/cache, also when a job fails or is cancelled.
+    def __init__(self, file: Path) -> None:
+        self.file = file
+
+    def read(self) -> List[HistoryRow]:
+        if not self.file.exists():
+            return []
+        rows = []
+        with self.file.open("rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(tuple(json.loads(line)))
+                except ValueError:
+                    # A crash in the middle of append leaves a partial last line.
+                    LOGGER.warning(f"Ignore broken schema history journal line: {line!r}")
+        return rows
+
+    def append(self, row: HistoryRow) -> None:
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        with self.file.open("at", encoding="utf-8") as f:
+            f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self) -> None:
+        self.file.unlink(missing_ok=True)
+
+
 class SchemaHistory:
     def __init__(
-        self, env: str, dir: Path, parent_project: str, project: str, dataset: str, table: str
+        self,
+        env: str,
+        dir: Path,
+        parent_project: str,
+        project: str,
+        dataset: str,
+        table: str,
+        checkpoint_interval: int = 0,
+        journal_dir: Path = BQ_SCHEMA_HISTORY_JOURNAL_DIR,
+        script_mode: bool = False,
+        create_history_table: bool = True,
+        parallel: bool = False,
+        max_worker: Optional[int] = None,
     ):
         self.env = env
         self.dir = dir
@@ -67,9 +230,35 @@ class SchemaHistory:
         self.project = project
         self.dataset = dataset
         self.table = table
+        # Number of buffered history rows that triggers a write, 0 writes once at the end.
+        self.checkpoint_interval = checkpoint_interval
+        self.journal = SchemaHistoryJournal(journal_dir / f"{self.history_table}.jsonl")
+        # Submit each migration file as one multi-statement script job instead of one job per
+        # statement.
+        self.script_mode = script_mode
+        # Apply migrations on unrelated tables concurrently, see plan_migrations.
+        self.parallel = parallel
+        self.max_worker = max_worker
 
         self._client = Client(project=self.parent_project)
-        self._create_schema_history_table()
+        self._pending: List[HistoryRow] = []
+        self._lock = threading.Lock()
+        self._connection: Optional[dbapi.Connection] = None
+        self._cursor: Optional[dbapi.Cursor] = None
+        if create_history_table:
+            self._create_schema_history_table()
+
+    def __enter__(self) -> SchemaHistory:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+        self._cursor = None
 
     @staticmethod
     def schema():
@@ -89,18 +278,20 @@ class SchemaHistory:
         return f"{self.project}.{self.dataset}.{self.table}"
 
     @contextlib.contextmanager
-    def dbapi_connection(self) -> Iterator[dbapi.Connection]:
-        conn = dbapi.Connection(self._client)
-        try:
+    def dbapi_cursor(self) -> Iterator[dbapi.Cursor]:
+        # One connection and cursor serve every statement of this instance.
+        if self._cursor is None:
+            conn = dbapi.Connection(self._client)
             # TODO PermissionDenied: bigquery.readsessions.create
             conn._bqstorage_client = None
             conn._owns_bqstorage_client = False
-            yield conn
+            self._connection = conn
+            self._cursor = conn.cursor()
+        try:
+            yield self._cursor
         except Exception as e:
             LOGGER.error(f"Unexpected error occurred in DB-API connection: {repr(e)}.")
             raise e
-        finally:
-            conn.close()
 
     def read_migration_config(self) -> List[SchemaMigrationConfig]:
         migrations = []
@@ -114,70 +305,123 @@ class SchemaHistory:
         self._client.create_table(table, exists_ok=True)
 
     def _run_query(self, query: str, dryrun: bool = False) -> None:
-        with self.dbapi_connection() as conn:
-            cursor = conn.cursor()
-            job_config = QueryJobConfig(use_legacy_sql=False, use_query_cache=False, dry_run=dryrun)
-            LOGGER.info(f"Migrate :\n{query}")
+        job_config = QueryJobConfig(use_legacy_sql=False, use_query_cache=False, dry_run=dryrun)
+        LOGGER.info(f"Migrate :\n{query}")
+        if self.parallel:
+            # The shared DB-API cursor is not safe across threads.
+            self._client.query(query, job_config=job_config).result()
+            return
+        with self.dbapi_cursor() as cursor:
             cursor.execute(query, job_config=job_config)
 
-    def get_max_installed_rank(self) -> int:
-        with self.dbapi_connection() as conn:
-            cursor = conn.cursor()
+    def dry_run(self, query: str) -> int:
+        # Query jobs are used directly, the shared DB-API cursor is not safe across threads.
+        job_config = QueryJobConfig(use_legacy_sql=False, use_query_cache=False, dry_run=True)
+        job = self._client.query(query, job_config=job_config)
+        return cast(int, job.total_bytes_processed or 0)
+
+    def load_schema_history(self) -> Dict[str, List[Dict[str, Any]]]:
+        with self.dbapi_cursor() as cursor:
             cursor.execute(
                 f"""
-                SELECT MAX(installed_rank) AS installed_rank FROM `{self.history_table}`
+                SELECT {", ".join(HISTORY_COLUMNS)} FROM `{self.history_table}`
+                ORDER BY installed_rank
                 """
             )
-            result = cursor.fetchall()
-            installed_rank = cast(int, result[0].installed_rank)
-            if not installed_rank:
-                return 1
-            else:
-                return installed_rank + 1
+            rows = cursor.fetchall()
+        history: Dict[str, List[Dict[str, Any]]] = {}
+        for r in rows:
+            if r.version is not None:
+                version = r.version.strftime(HISTORY_TIMESTAMP_FORMAT)
+                history.setdefault(version, []).append(dict(r.items()))
+        return history
 
-    def get_schema_history(self, version: datetime) -> Any:
-        with self.dbapi_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT * FROM `{self.history_table}`
-                WHERE version = %s
-                """,
-                (version.strftime("%Y-%m-%d %H:%M:%S"),),
-            )
-            return cursor.fetchall()
+    @staticmethod
+    def history_row(
+        installed_rank: int, migration: SchemaMigrationConfig, execution_time: int, success: bool
+    ) -> HistoryRow:
+        return (
+            installed_rank,
+            migration.version.strftime(HISTORY_TIMESTAMP_FORMAT),
+            migration.description,
+            migration.script,
+            migration.checksum,
+            migration.installed_on.strftime(HISTORY_TIMESTAMP_FORMAT),
+            execution_time,
+            success,
+        )
 
-    def insert_schema_history(
-        self,
-        installed_rank: int,
-        migration: SchemaMigrationConfig,
-        execution_time: int,
-        success: bool,
-    ) -> Any:
-        with self.dbapi_connection() as conn:
-            cursor = conn.cursor()
+    def insert_schema_history_rows(self, rows: List[HistoryRow]) -> Any:
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+        with self.dbapi_cursor() as cursor:
             cursor.execute(
                 f"""
                 INSERT INTO `{self.history_table}`
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES {values}
                 """,
-                (
-                    installed_rank,
-                    migration.version.strftime("%Y-%m-%d %H:%M:%S"),
-                    migration.description,
-                    migration.script,
-                    migration.checksum,
-                    migration.installed_on.strftime("%Y-%m-%d %H:%M:%S"),
-                    execution_time,
-                    success,
-                ),
+                tuple(v for r in rows for v in r),
             )
             return cursor.fetchall()
 
-    def _migrate(self, migration: SchemaMigrationConfig, dryrun: bool = False) -> Optional[str]:
-        history = self.get_schema_history(migration.version)
+    def _record_schema_history(self, row: HistoryRow) -> None:
+        with self._lock:
+            self.journal.append(row)
+            self._pending.append(row)
+            if self.checkpoint_interval and len(self._pending) >= self.checkpoint_interval:
+                self._flush_schema_history()
+
+    def flush_schema_history(self) -> None:
+        with self._lock:
+            self._flush_schema_history()
+
+    def _flush_schema_history(self) -> None:
+        if not self._pending:
+            return
+        LOGGER.info(f"Write {len(self._pending)} schema history row(s) to {self.history_table}")
+        self.insert_schema_history_rows(sorted(self._pending, key=lambda r: r[0]))
+        self._pending = []
+        self.journal.clear()
+
+    def statements(self, migration: SchemaMigrationConfig) -> List[str]:
+        return [migration.script_query] if self.script_mode else migration.queries
+
+    def history_table_exists(self) -> bool:
+        try:
+            self._client.get_table(self.history_table)
+        except NotFound:
+            return False
+        return True
+
+    def pending_migrations(self) -> List[SchemaMigrationConfig]:
+        # Nothing has been applied before the first migrate creates the history table.
+        history = self.load_schema_history() if self.history_table_exists() else {}
+        # Journal rows are migrations applied by a run that did not write their history.
+        applied = set(history) | {r[1] for r in self.journal.read()}
+        return [
+            m
+            for m in self.read_migration_config()
+            if m.version.strftime(HISTORY_TIMESTAMP_FORMAT) not in applied
+        ]
+
+    def _recover_schema_history(self, history: Dict[str, List[Dict[str, Any]]]) -> None:
+        # Rows of a crashed run may or may not have been written before the crash.
+        rows = [r for r in self.journal.read() if r[1] not in history]
+        if rows:
+            LOGGER.warning(f"Recover {len(rows)} schema history row(s) from {self.journal.file}")
+            self.insert_schema_history_rows(rows)
+        for r in rows:
+            history.setdefault(r[1], []).append(dict(zip(HISTORY_COLUMNS, r)))
+        self.journal.clear()
+
+    def _migrate(
+        self,
+        migration: SchemaMigrationConfig,
+        history: List[Dict[str, Any]],
+        installed_rank: int,
+        dryrun: bool = False,
+    ) -> Optional[str]:
         if history:
-            if migration.checksum != history[0].checksum:
+            if migration.checksum != history[0]["checksum"]:
                 slack.post_to_slack(
                     project=self.project,
                     env=self.env,
@@ -190,18 +434,19 @@ class SchemaHistory:
             LOGGER.info(f"Migration script has been applied: {migration.script}")
             return None
 
-        installed_rank = self.get_max_installed_rank()
         start = time.time()
         exceptions = []
         try:
-            for q in migration.queries:
+            for q in self.statements(migration):
                 self._run_query(q, dryrun)
         except Exception:
             LOGGER.error(f"Schema migration failed: {migration.script}")
             exceptions.append(traceback.format_exc())
         elapsed = int((time.time() - start) * 1000)
-        self.insert_schema_history(
-            installed_rank, migration, elapsed, False if exceptions else True
+        self._record_schema_history(
+            SchemaHistory.history_row(
+                installed_rank, migration, elapsed, False if exceptions else True
+            )
         )
         if exceptions:
             exception = "\n\n".join(exceptions)
@@ -218,13 +463,57 @@ class SchemaHistory:
             return None
         return migration.script
 
+    def _migrate_parallel(
+        self,
+        migrations: List[SchemaMigrationConfig],
+        history: Dict[str, List[Dict[str, Any]]],
+        installed_ranks: Dict[str, int],
+    ) -> List[str]:
+        pending = []
+        for m in migrations:
+            version = m.version.strftime(HISTORY_TIMESTAMP_FORMAT)
+            if version in history:
+                self._migrate(m, history[version], 0)
+            else:
+                pending.append(m)
+        depends = plan_migrations(pending)
+        jobs = []
+        for m in pending:
+            LOGGER.debug(f"migration: {m.script} depends on {depends[m.script]}")
+            args: Tuple[Any, ...] = (m, [], installed_ranks[m.script])
+            jobs.append(Job(m.script, self._migrate, args, depends=depends[m.script]))
+        results = run_jobs(jobs, self.max_worker)
+        results = sorted(results, key=lambda r: installed_ranks[r.job.name])
+        return [r.result for r in results if r.result]
+
     def migrate(self):
         migrations = self.read_migration_config()
+        # One query for the whole history, installed ranks are assigned locally from there on.
+        history = self.load_schema_history()
+        self._recover_schema_history(history)
+        ranks = [r["installed_rank"] or 0 for rows in history.values() for r in rows]
+        pending = [
+            m for m in migrations if m.version.strftime(HISTORY_TIMESTAMP_FORMAT) not in history
+        ]
+        # Ranks follow version order whichever order the migrations finish in.
+        first_rank = max(ranks, default=0) + 1
+        installed_ranks = {m.script: first_rank + i for i, m in enumerate(pending)}
         executed_scripts = []
-        for m in migrations:
-            executed = self._migrate(m)
-            if executed:
-                executed_scripts.append(executed)
+        try:
+            if self.parallel:
+                executed_scripts = self._migrate_parallel(migrations, history, installed_ranks)
+            else:
+                for m in migrations:
+                    version = m.version.strftime(HISTORY_TIMESTAMP_FORMAT)
+                    executed = self._migrate(
+                        m, history.get(version, []), installed_ranks.get(m.script, 0)
+                    )
+                    if executed:
+                        executed_scripts.append(executed)
+        finally:
+            # History rows are written in one statement per checkpoint. The journal keeps the
+            # rest for the next run on the same disk if this write does not happen.
+            self.flush_schema_history()
 
         if executed_scripts:
             message = "\n".join(executed_scripts)
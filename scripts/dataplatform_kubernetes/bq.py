@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from typing import Any, Callable, Dict, Optional, Set
+
 import click
 from dataplatform_kubernetes import BASE_DIR, ENVIRONMENTS
-from dataplatform_kubernetes.bigquery.schema_history import SchemaHistory
+
+MIGRATIONS_DIR = BASE_DIR / "bigquery" / "migrations"
 
 
 @click.group()
@@ -15,31 +18,165 @@ def schema() -> None:
     pass
 
 
+def history_table_options(f: Callable[..., Any]) -> Callable[..., Any]:
+    options = [
+        click.option(
+            "-e",
+            "--env",
+            required=True,
+            type=click.Choice(ENVIRONMENTS),
+            help="Environments to which the migration applies (dev/prod)",
+        ),
+        click.option(
+            "-p",
+            "--project",
+            required=True,
+            type=str,
+            help="Project for storing the migration history",
+        ),
+        click.option(
+            "-d",
+            "--dataset",
+            required=True,
+            type=str,
+            help="Dataset for storing the migration history",
+        ),
+        click.option(
+            "-t", "--table", required=True, type=str, help="Table for storing the migration history"
+        ),
+        click.option("--parent-project", type=str, help="Project to run the query"),
+        click.option(
+            "--script-mode",
+            is_flag=True,
+            default=False,
+            help="Run each migration file as one multi-statement script job",
+        ),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
 @schema.command()
+@history_table_options
 @click.option(
-    "-e",
-    "--env",
-    required=True,
-    type=click.Choice(ENVIRONMENTS),
-    help="Environments to which the migration applies (dev/prod)",
+    "--checkpoint-interval",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Write the migration history every N applied migrations (0: once at the end). Rows not "
+    "written yet are kept in a journal under .cache/bigquery, which the next run recovers",
 )
 @click.option(
-    "-p", "--project", required=True, type=str, help="Project for storing the migration history"
+    "--parallel",
+    is_flag=True,
+    default=False,
+    help="Apply migrations on unrelated tables concurrently, in version order per table",
 )
 @click.option(
-    "-d", "--dataset", required=True, type=str, help="Dataset for storing the migration history"
+    "--max-worker", type=int, required=False, help="Defaults to the number of CPUs", default=None
 )
+def migrate(
+    env: str,
+    project: str,
+    dataset: str,
+    table: str,
+    parent_project: str,
+    script_mode: bool,
+    checkpoint_interval: int,
+    parallel: bool,
+    max_worker: Optional[int],
+) -> None:
+    from dataplatform_kubernetes.bigquery.schema_history import SchemaHistory
+
+    with SchemaHistory(
+        env=env,
+        dir=MIGRATIONS_DIR,
+        parent_project=parent_project if parent_project else project,
+        project=project,
+        dataset=dataset,
+        table=table,
+        checkpoint_interval=checkpoint_interval,
+        script_mode=script_mode,
+        parallel=parallel,
+        max_worker=max_worker,
+    ) as schema_history:
+        schema_history.migrate()
+
+
+@schema.command()
+@history_table_options
 @click.option(
-    "-t", "--table", required=True, type=str, help="Table for storing the migration history"
+    "--max-worker", type=int, required=False, help="Defaults to the number of CPUs", default=None
 )
-@click.option("--parent-project", type=str, help="Project to run the query")
-def migrate(env: str, project: str, dataset: str, table: str, parent_project: str) -> None:
-    schema_history = SchemaHistory(
+def validate(
+    env: str,
+    project: str,
+    dataset: str,
+    table: str,
+    parent_project: str,
+    script_mode: bool,
+    max_worker: Optional[int],
+) -> None:
+    from dataplatform_kubernetes.bigquery.schema_history import (
+        SchemaHistory,
+        created_table,
+        not_found_table,
+    )
+    from dataplatform_kubernetes.scheduler import Job, JobsFailed, run_jobs
+
+    # Dry runs only: nothing is applied and the history table is left untouched.
+    with SchemaHistory(
         env=env,
-        dir=BASE_DIR / "bigquery" / "migrations",
+        dir=MIGRATIONS_DIR,
         parent_project=parent_project if parent_project else project,
         project=project,
         dataset=dataset,
         table=table,
+        script_mode=script_mode,
+        create_history_table=False,
+    ) as schema_history:
+        migrations = schema_history.pending_migrations()
+        jobs = []
+        # Tables created by statements before each job. A dry run cannot see them yet.
+        created_before: Dict[str, Set[str]] = {}
+        tables: Set[str] = set()
+        for m in migrations:
+            if script_mode:
+                tables |= {t for t in map(created_table, m.queries) if t}
+            for i, q in enumerate(schema_history.statements(m), start=1):
+                jobs.append(Job(f"{m.script}#{i}", schema_history.dry_run, (q,)))
+                created_before[jobs[-1].name] = set(tables)
+                created = created_table(q)
+                if created is not None and not script_mode:
+                    tables.add(created)
+        failures = {}
+        skipped = {}
+        try:
+            results = run_jobs(jobs, max_worker, keep_going=True)
+        except JobsFailed as e:
+            results = e.results
+            for r in e.failures:
+                missing = not_found_table(str(r.error))
+                if missing is not None and missing in created_before[r.job.name]:
+                    skipped[r.job.name] = r.error
+                else:
+                    failures[r.job.name] = r.error
+
+    processed = {r.job.name: r.result for r in results}
+    for j in jobs:
+        if j.name in failures:
+            click.echo(f"error {j.name}: {failures[j.name]}", err=True)
+        elif j.name in skipped:
+            click.echo(f"skip  {j.name}: {skipped[j.name]}", err=True)
+        else:
+            click.echo(
+                f"ok    {j.name}: {processed[j.name] / 1024 ** 2:.1f} MiB processed", err=True
+            )
+    click.echo(
+        f"pending={len(migrations)} statements={len(jobs)} failed={len(failures)} "
+        f"skipped={len(skipped)} bytes_processed={sum(processed.values())}",
+        err=True,
     )
-    schema_history.migrate()
+    if failures:
+        raise RuntimeError("Schema validation failed.")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from dataplatform_kubernetes import (
+    AVRO_AVSC_FILE,
+    BASE_DIR,
+    CUE_AVRO_TOOL_FILE,
+    CUE_COMMAND,
+    CUE_MODULE_DIR,
+    CUE_SCRIPTS_DIR,
+    LOGGER,
+)
+from dataplatform_kubernetes.snapshot import get_snapshot
+from dataplatform_kubernetes.util import (
+    create_temp_output,
+    exec_command,
+    replace_if_changed,
+)
+
+
+@lru_cache(maxsize=None)
+def get_cue_version() -> str:
+    lines, _ = exec_command([CUE_COMMAND, "version"], echo=False)
+    return "".join(lines).strip()
+
+
+def cue_module_digest(module_dir: Path) -> str:
+    # module.cue and the vendored and generated packages are imported from outside the module,
+    # which the dependency index does not follow.
+    sha = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(module_dir):
+        dirnames.sort()
+        for f in sorted(filenames):
+            file = Path(dirpath) / f
+            sha.update(str(file.relative_to(module_dir)).encode("utf-8"))
+            sha.update(b"\0")
+            sha.update(_sha256(file).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def dump_cache_salt() -> str:
+    return f"{get_cue_version()}\0{cue_module_digest(CUE_MODULE_DIR)}"
+
+
+class DumpCache:
+
+    def __init__(self, cache_dir: Path, max_size: int, salt: str = "") -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Digests of input files by (path, mtime, size), reused while the process lives.
+        self._digests: Dict[Tuple[Path, int, int], bytes] = {}
+
+    def _digest(self, file: Path) -> bytes:
+        stat = file.stat()
+        memo = (file, stat.st_mtime_ns, stat.st_size)
+        digest = self._digests.get(memo)
+        if digest is None:
+            with file.open("rb") as r:
+                digest = hashlib.sha256(r.read()).digest()
+            self._digests[memo] = digest
+        return digest
+
+    def key(self, dirs: Iterable[Path], files: Iterable[Path]) -> str:
+        sha = hashlib.sha256()
+        sha.update(self.salt.encode("utf-8"))
+        sha.update(b"\0")
+        snapshot = get_snapshot()
+        inputs = [f for d in dirs for f in snapshot.cue_file_paths(d)]
+        inputs.extend(files)
+        for f in inputs:
+            sha.update(str(f.resolve().relative_to(BASE_DIR)).encode("utf-8"))
+            sha.update(b"\0")
+            sha.update(self._digest(f))
+        return sha.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.yaml"
+
+    def get(self, key: str) -> Optional[Path]:
+        entry = self._entry(key)
+        with self._lock:
+            if not entry.exists():
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Refresh the timestamp so that eviction is least-recently-used.
+            os.utime(entry)
+        LOGGER.debug(f"cache hit: {key}")
+        return entry
+
+    def restore(self, key: str, output: Path) -> Optional[str]:
+        entry = self.get(key)
+        if entry is None:
+            return None
+        fd, tmp = create_temp_output(output.parent.resolve() / output.name)
+        os.close(fd)
+        try:
+            shutil.copyfile(entry, tmp)
+            return replace_if_changed(tmp, output)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def put(self, key: str, output: Path) -> None:
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=entry.parent, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(output, tmp)
+        os.replace(tmp, entry)
+
+    def evict(self) -> None:
+        # Called once per run, it stats every entry of the cache.
+        with self._lock:
+            entries = [(e.stat(), e) for e in self.cache_dir.glob("*/*.yaml")]
+            total = sum(s.st_size for s, _ in entries)
+            for s, e in sorted(entries, key=lambda x: x[0].st_mtime):
+                if total <= self.max_size:
+                    break
+                LOGGER.debug(f"cache evict: {e.name}")
+                e.unlink(missing_ok=True)
+                total -= s.st_size
+
+    def summary(self) -> str:
+        return f"cue cache: hits={self.hits} misses={self.misses}"
+
+
+def _sha256(file: Path) -> str:
+    sha = hashlib.sha256()
+    with file.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+AVRO_FINGERPRINT_SUFFIX = ".fingerprint.json"
+
+
+def avro_fingerprint_file(idl_file: Path) -> Path:
+    return idl_file.parent / f".{idl_file.name}{AVRO_FINGERPRINT_SUFFIX}"
+
+
+def is_avro_fingerprint_file(name: str) -> bool:
+    return name.startswith(".") and name.endswith(AVRO_FINGERPRINT_SUFFIX)
+
+
+def avro_fingerprint(idl_file: Path, config_map: Path) -> Dict[str, Any]:
+    # The ancestor cue files are passed to the avsc command, they define AvroMetadata.
+    snapshot = get_snapshot()
+    metadata = [
+        f for d in snapshot.ancestor_cue_dirs(idl_file.parent) for f in snapshot.cue_file_paths(d)
+    ]
+    return {
+        "idl": _sha256(idl_file),
+        "tool": _sha256(CUE_SCRIPTS_DIR / CUE_AVRO_TOOL_FILE),
+        "metadata": {str(f.relative_to(BASE_DIR)): _sha256(f) for f in metadata},
+        "schemas": {f.name: _sha256(f) for f in sorted(idl_file.parent.glob(AVRO_AVSC_FILE))},
+        "config_map": str(config_map.relative_to(BASE_DIR)),
+        "config_map_digest": _sha256(config_map),
+    }
+
+
+def read_avro_fingerprint(idl_file: Path) -> Optional[str]:
+    fingerprint_file = avro_fingerprint_file(idl_file)
+    if not fingerprint_file.exists():
+        return None
+    try:
+        with fingerprint_file.open("rt", encoding="utf-8") as f:
+            fingerprint = json.load(f)
+        config_map = BASE_DIR / fingerprint["config_map"]
+        if not config_map.exists() or fingerprint != avro_fingerprint(idl_file, config_map):
+            return None
+    except (ValueError, KeyError, TypeError):
+        LOGGER.warning(f"Ignore broken fingerprint: {fingerprint_file}")
+        return None
+    return str(config_map)
+
+
+def write_avro_fingerprint(idl_file: Path, config_map: str) -> None:
+    with avro_fingerprint_file(idl_file).open("wt", encoding="utf-8") as f:
+        json.dump(avro_fingerprint(idl_file, Path(config_map).resolve()), f, indent=2)
@@ -1,27 +1,46 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import Any
+import importlib
+from typing import Any, Dict, List, Optional
 
 import click
 from dataplatform_kubernetes import ContextArgument
-from dataplatform_kubernetes.bq import bq
-from dataplatform_kubernetes.cue import cue
-from dataplatform_kubernetes.gh import github
-from dataplatform_kubernetes.scaffold import scaffold
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+# Subcommand modules pull in SDKs such as PyGithub, BigQuery and Slack, so a module is only
+# imported when its command is invoked.
+LAZY_SUBCOMMANDS = {
+    "github": "dataplatform_kubernetes.gh:github",
+    "cue": "dataplatform_kubernetes.cue:cue",
+    "bq": "dataplatform_kubernetes.bq:bq",
+    "scaffold": "dataplatform_kubernetes.scaffold:scaffold",
+    "benchmark": "dataplatform_kubernetes.benchmark:benchmark",
+}
 
 
-@click.group(context_settings=CONTEXT_SETTINGS)
+class LazyGroup(click.Group):
+    def __init__(
+        self, *args: Any, lazy_subcommands: Optional[Dict[str, str]] = None, **kwargs: Any
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name not in self.lazy_subcommands:
+            return super().get_command(ctx, cmd_name)
+        module_name, attr = self.lazy_subcommands[cmd_name].split(":")
+        command: click.Command = getattr(importlib.import_module(module_name), attr)
+        return command
+
+
+@click.group(cls=LazyGroup, lazy_subcommands=LAZY_SUBCOMMANDS, context_settings=CONTEXT_SETTINGS)
 @click.pass_context
 def cli(ctx: Any) -> None:
     ctx.obj = ContextArgument()
 
 
-cli.add_command(github)
-cli.add_command(cue)
-cli.add_command(bq)
-cli.add_command(scaffold)
-
 if __name__ == "__main__":
     cli()
@@ -1,32 +1,99 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import concurrent
+import collections
+import cProfile
+import io
+import json
+import os
+import pstats
 import re
-from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import time
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, List
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Set, Tuple
 
 import click
 from dataplatform_kubernetes import (
+    AVRO_AVDL_FILE,
+    AVRO_IDL_BATCH_SOURCE,
+    AVRO_TOOLS_JAR,
     BASE_DIR,
     CUE_AVRO_TOOL_FILE,
+    CUE_BATCH_TOOL_TEMPLATE,
+    CUE_CACHE_DIR,
+    CUE_CACHE_MAX_SIZE,
     CUE_CLI_TOOL_FILE,
     CUE_COMMAND,
     CUE_COMMAND_AVRO_AVDL,
     CUE_COMMAND_AVRO_AVSC,
     CUE_COMMAND_CMD,
     CUE_COMMAND_DUMP,
+    CUE_COMMAND_DUMP_BATCH,
     CUE_COMMAND_EVAL,
+    CUE_DELIVERY_FILE,
+    CUE_MANIFESTS_DIR,
+    CUE_MODULE_PATH,
+    CUE_PKG_DIR,
     CUE_SCRIPTS_DIR,
+    CUE_STATS_FILE,
+    CUE_UPLOAD_LEDGER_DIR,
+    JAVA_COMMAND,
     LOGGER,
     ContextArgument,
 )
+from dataplatform_kubernetes.cache import (
+    DumpCache,
+    dump_cache_salt,
+    is_avro_fingerprint_file,
+    read_avro_fingerprint,
+    write_avro_fingerprint,
+)
+from dataplatform_kubernetes.deps import DependencyIndex
+from dataplatform_kubernetes.manifest import split_manifest
+from dataplatform_kubernetes.scheduler import (
+    Job,
+    JobResult,
+    JobsFailed,
+    JobStats,
+    critical_path,
+    format_critical_path,
+    run_jobs,
+    select_shard,
+    units_digest,
+)
+from dataplatform_kubernetes.snapshot import get_snapshot
+from dataplatform_kubernetes.storage import (
+    ObjectStore,
+    UploadLedger,
+    crc32c,
+    get_object_store,
+)
 from dataplatform_kubernetes.util import (
+    OUTPUT_CHANGED,
+    OUTPUT_NEW,
+    OUTPUT_UNCHANGED,
+    CommandError,
     exec_command,
+    exec_command_to_file,
+    format_command,
     get_changed_avro_files,
-    get_changed_cue_dir,
     get_changed_dir,
+    get_git_changes,
+    write_if_changed,
 )
+from dataplatform_kubernetes.validation import validate_shard
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+TEMPLATE_DIR = BASE_DIR / "scripts" / "resources" / "cue"
+AVRO_IDL_BATCH_JOB = "avro:idl2schemata"
+WATCH_SUFFIXES = (".cue", ".avdl")
+MERGE_OUTPUT_KEYS = ("cue_files", "resource_files", "orphaned_files")
+SHARD_OUTPUT_KEYS = ("shard", "shard_total", "shard_units")
+PROFILE_LIMIT = 30
 
 
 @click.group()
@@ -34,40 +101,135 @@ def cue() -> None:
     pass
 
 
-def _get_parent_cue_file_dir(base_dir: str, dir: Path) -> List[Path]:
-    dirs = []
-    while True:
-        if base_dir == str(dir.resolve()):
-            break
-        if list(dir.glob("*.cue")):
-            dirs.append(dir.resolve())
-        dir = dir.parent
-    return dirs
+@lru_cache(maxsize=None)
+def _get_template_env() -> "Environment":
+    from jinja2 import Environment, FileSystemLoader
+
+    return Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+
 
+def _get_parent_cue_file_dir(dir: Path) -> List[Path]:
+    return list(get_snapshot().ancestor_cue_dirs(dir))
 
-def _dump(cmd: str, output: str) -> str:
-    LOGGER.debug(f"command: {cmd}")
-    lines, _ = exec_command(cmd, echo=False)
+
+@dataclass
+class EvalOutput:
+    lines: List[str]
+    return_code: int
+
+
+@dataclass
+class DumpOutput:
+    path: str
+    status: str
+
+
+def _dump(
+    cmd: List[str], output: str, cache: Optional[DumpCache] = None, key: Optional[str] = None
+) -> DumpOutput:
+    LOGGER.debug(f"command: {format_command(cmd)}")
     output = Path(output)
-    output.parent.resolve().mkdir(parents=True, exist_ok=True)
-    LOGGER.debug(f"outoput: {output}")
-    with open(output, "wt", encoding="utf-8") as f:
-        f.write("".join(lines))
-    return str(output)
+    status = exec_command_to_file(cmd, output.parent.resolve() / output.name)
+    LOGGER.debug(f"outoput ({status}): {output}")
+    if cache is not None and key is not None:
+        cache.put(key, output)
+    return DumpOutput(str(output), status)
+
+
+def _dump_batch(
+    cue_file_dirs: List[Path],
+    index: DependencyIndex,
+    cache: Optional[DumpCache] = None,
+    keys: Optional[Dict[Path, str]] = None,
+) -> List[DumpOutput]:
+    fd, tool_file = tempfile.mkstemp(dir=CUE_SCRIPTS_DIR, prefix="batch_", suffix="_tool.cue")
+    result_file = Path(tool_file).with_suffix(".json")
+    try:
+        with os.fdopen(fd, "wt", encoding="utf-8") as f:
+            f.write(_build_dump_batch_tool(cue_file_dirs, index))
+        cmd = _build_dump_batch_command(Path(tool_file))
+        LOGGER.debug(f"command: {format_command(cmd)}")
+        exec_command_to_file(cmd, result_file)
+        with result_file.open("rt", encoding="utf-8") as f:
+            results = json.load(f)
+    finally:
+        os.unlink(tool_file)
+        result_file.unlink(missing_ok=True)
+
+    outputs = []
+    for c in cue_file_dirs:
+        output = Path(str(c.resolve()) + ".yaml")
+        # cli.Print terminates the text with a newline, which the per-dir dump writes as well.
+        text = results[str(c.resolve().relative_to(BASE_DIR))] + "\n"
+        status = write_if_changed(output, text)
+        LOGGER.debug(f"outoput ({status}): {output}")
+        if cache is not None and keys is not None:
+            cache.put(keys[c], output)
+        outputs.append(DumpOutput(str(output), status))
+    return outputs
+
 
+def _restore_cached_dumps(
+    cue_file_dirs: Iterable[Path], index: DependencyIndex, cache: DumpCache
+) -> Tuple[List[DumpOutput], Dict[Path, str]]:
+    restored = []
+    keys = {}
+    tool_file = CUE_SCRIPTS_DIR / CUE_CLI_TOOL_FILE
+    # The tool file imports packages too, pkg/k8s for #InstallOrder.
+    tool_dirs = index.file_dependency_dirs(tool_file)
+    for c in cue_file_dirs:
+        key = cache.key(index.dependency_dirs(c) + tool_dirs, [tool_file])
+        output = Path(str(c.resolve()) + ".yaml")
+        status = cache.restore(key, output)
+        if status is not None:
+            LOGGER.debug(f"outoput (cached, {status}): {output}")
+            restored.append(DumpOutput(str(output), status))
+        else:
+            keys[c] = key
+    return restored, keys
 
-def _gen_avro(idl_cmd: str, schema_cmd: str) -> str:
-    LOGGER.debug(f"command: {idl_cmd}")
+
+def _gen_avro(
+    idl_cmd: List[str], schema_cmd: List[str], idl_file: Path, fingerprint: bool = False
+) -> DumpOutput:
+    LOGGER.debug(f"command: {format_command(idl_cmd)}")
+    exec_command(idl_cmd, echo=False)
+    return _gen_avro_config_map(schema_cmd, idl_file, fingerprint)
+
+
+def _gen_avro_schemata(idl_cmd: List[str]) -> List[DumpOutput]:
+    LOGGER.debug(f"command: {format_command(idl_cmd)}")
     exec_command(idl_cmd, echo=False)
-    LOGGER.debug(f"command: {schema_cmd}")
+    return []
+
+
+def _gen_avro_config_map(
+    schema_cmd: List[str], idl_file: Path, fingerprint: bool = False
+) -> DumpOutput:
+    # cue rewrites the ConfigMap unconditionally, so remember the previous contents to restore
+    # the mtime of an identical file.
+    previous = {}
+    for f in idl_file.parent.glob("*.yaml"):
+        previous[f.resolve()] = (f.read_bytes(), f.stat())
+    LOGGER.debug(f"command: {format_command(schema_cmd)}")
     lines, _ = exec_command(schema_cmd, echo=False)
     output = "".join(lines).strip()
-    LOGGER.debug(f"outoput: {output}")
-    return output
+    status = OUTPUT_NEW
+    if Path(output).resolve() in previous:
+        contents, stat = previous[Path(output).resolve()]
+        if Path(output).read_bytes() == contents:
+            os.utime(output, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            status = OUTPUT_UNCHANGED
+        else:
+            status = OUTPUT_CHANGED
+    LOGGER.debug(f"outoput ({status}): {output}")
+    if fingerprint:
+        write_avro_fingerprint(idl_file, output)
+    return DumpOutput(output, status)
 
 
-def _build_dump_command(cue_file_dir: Path, debug: bool = False) -> str:
-    dirs = _get_parent_cue_file_dir(str(BASE_DIR), cue_file_dir.parent)
+def _build_dump_command(cue_file_dir: Path, debug: bool = False) -> List[str]:
+    dirs = _get_parent_cue_file_dir(cue_file_dir.parent)
     if debug:
         cmd = [
             CUE_COMMAND,
@@ -84,11 +246,127 @@ def _build_dump_command(cue_file_dir: Path, debug: bool = False) -> str:
     cmd.extend([str(f"./{d.relative_to(str(BASE_DIR))}") for d in dirs])
     if not debug:
         cmd.append(f"./{CUE_SCRIPTS_DIR.relative_to(str(BASE_DIR))}/{CUE_CLI_TOOL_FILE}")
-    return " ".join(cmd)
+    return cmd
+
+
+def _eval(*cmds: List[str]) -> EvalOutput:
+    lines = []
+    return_code = 0
+    for cmd in cmds:
+        lines.append(f"{format_command(cmd)}\n")
+        output, return_code = exec_command(cmd, echo=False, check_return_code=False)
+        lines.extend(output)
+        if return_code != 0:
+            break
+    return EvalOutput(lines, return_code)
+
+
+def _echo_eval_results(results: List[JobResult]) -> None:
+    failed = []
+    for r in sorted(results, key=lambda r: r.job.name):
+        click.echo(f"==> {r.job.name}")
+        click.echo("".join(r.result.lines), nl=False)
+        if r.result.return_code != 0:
+            failed.append(r)
+    if failed:
+        click.echo(f"{len(failed)} of {len(results)} job(s) failed:")
+        for r in failed:
+            click.echo(f"  {r.job.name} (return code: {r.result.return_code})")
+        raise RuntimeError("cue eval failed.")
+
+
+def _output_size(result: Any) -> int:
+    if isinstance(result, list):
+        return sum(_output_size(r) for r in result)
+    if isinstance(result, DumpOutput) and os.path.exists(result.path):
+        return os.path.getsize(result.path)
+    if isinstance(result, EvalOutput):
+        return sum(len(line.encode("utf-8")) for line in result.lines)
+    return 0
+
+
+def _format_profile(profiler: cProfile.Profile) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_LIMIT)
+    return stream.getvalue()
+
+
+def _write_report(
+    report_json: Path, results: List[JobResult], wall_time: float, profile: Optional[str]
+) -> None:
+    jobs = []
+    for r in sorted(results, key=lambda r: r.start):
+        jobs.append(
+            {
+                "name": r.job.name,
+                "worker": r.worker,
+                "wall_time": r.duration,
+                "queue_wait": r.queue_wait,
+                "cpu_time": r.usage.cpu_time,
+                "peak_rss_kb": r.usage.max_rss,
+                "commands": r.usage.commands,
+                "output_bytes": _output_size(r.result),
+            }
+        )
+    report = {
+        "wall_time": wall_time,
+        "jobs": jobs,
+        "critical_path": [r.job.name for r in critical_path(results)],
+        "profile": profile,
+    }
+    report_json.parent.mkdir(parents=True, exist_ok=True)
+    with report_json.open("wt", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+def _echo_job_failures(e: JobsFailed) -> None:
+    for r in sorted(e.failures, key=lambda r: r.job.name):
+        click.echo(f"==> {r.job.name}: {r.error}", err=True)
+        if isinstance(r.error, CommandError):
+            click.echo(f"$ {format_command(r.error.cmd)}", err=True)
+            click.echo("".join(r.error.output), nl=False, err=True)
+    click.echo(f"{len(e.failures)} job(s) failed, {len(e.results)} succeeded", err=True)
+
 
+def _group_dump_batches(cue_file_dirs: Iterable[Path], batch_size: int) -> List[List[Path]]:
+    groups: Dict[Tuple[Path, ...], List[Path]] = {}
+    for c in sorted(cue_file_dirs):
+        chain = tuple(_get_parent_cue_file_dir(c.parent))
+        groups.setdefault(chain, []).append(c)
+    batches = []
+    for _, dirs in sorted(groups.items()):
+        for i in range(0, len(dirs), batch_size):
+            batches.append(dirs[i : i + batch_size])
+    return batches
 
-def _build_avro_avdl_command(idl_file: Path) -> str:
-    dirs = _get_parent_cue_file_dir(str(BASE_DIR), idl_file.parent)
+
+def _build_dump_batch_tool(cue_file_dirs: List[Path], index: DependencyIndex) -> str:
+    deliveries = []
+    for i, c in enumerate(cue_file_dirs):
+        deliveries.append(
+            {
+                "alias": f"d{i}",
+                "dir": str(c.resolve().relative_to(BASE_DIR)),
+                "package": sorted(index.packages[c.resolve()])[0],
+            }
+        )
+    template = _get_template_env().get_template(CUE_BATCH_TOOL_TEMPLATE)
+    return template.render(module=CUE_MODULE_PATH, deliveries=deliveries) + "\n"
+
+
+def _build_dump_batch_command(tool_file: Path) -> List[str]:
+    cmd = [
+        CUE_COMMAND,
+        CUE_COMMAND_CMD,
+        CUE_COMMAND_DUMP_BATCH,
+        f"./{tool_file.relative_to(str(BASE_DIR))}",
+    ]
+    return cmd
+
+
+def _build_avro_avdl_command(idl_file: Path) -> List[str]:
+    dirs = _get_parent_cue_file_dir(idl_file.parent)
     cmd = [
         CUE_COMMAND,
         CUE_COMMAND_CMD,
@@ -100,11 +378,23 @@ def _build_avro_avdl_command(idl_file: Path) -> str:
     ]
     cmd.extend([str(f"./{d.relative_to(str(BASE_DIR))}") for d in dirs])
     cmd.append(f"./{CUE_SCRIPTS_DIR.relative_to(str(BASE_DIR))}/{CUE_AVRO_TOOL_FILE}")
-    return " ".join(cmd)
+    return cmd
 
 
-def _build_avro_avsc_command(idl_file: Path) -> str:
-    dirs = _get_parent_cue_file_dir(str(BASE_DIR), idl_file.parent)
+def _build_avro_idl_batch_command(idl_files: Iterable[Path], avro_tools: str) -> List[str]:
+    cmd = [
+        JAVA_COMMAND,
+        "-cp",
+        avro_tools,
+        str(AVRO_IDL_BATCH_SOURCE),
+    ]
+    for f in sorted(idl_files):
+        cmd.extend([str(f.resolve()), f"{f.parent.resolve()}/"])
+    return cmd
+
+
+def _build_avro_avsc_command(idl_file: Path) -> List[str]:
+    dirs = _get_parent_cue_file_dir(idl_file.parent)
     cmd = [
         CUE_COMMAND,
         CUE_COMMAND_CMD,
@@ -116,7 +406,7 @@ def _build_avro_avsc_command(idl_file: Path) -> str:
     ]
     cmd.extend([str(f"./{d.relative_to(str(BASE_DIR))}") for d in dirs])
     cmd.append(f"./{CUE_SCRIPTS_DIR.relative_to(str(BASE_DIR))}/{CUE_AVRO_TOOL_FILE}")
-    return " ".join(cmd)
+    return cmd
 
 
 def _read_changed_file(changed_file: Path) -> List[Path]:
@@ -129,6 +419,40 @@ def _read_changed_file(changed_file: Path) -> List[Path]:
     return files
 
 
+def _shard_units(cue_dir: Set[Path], avro_files: Set[Path]) -> Dict[str, Path]:
+    units = {f"dump:{c.resolve().relative_to(BASE_DIR)}": c for c in cue_dir}
+    units.update({f"avro:{a.resolve().relative_to(BASE_DIR)}": a for a in avro_files})
+    return units
+
+
+def _check_shards(shards: List[Dict[str, str]]) -> None:
+    sharded = [s for s in shards if "shard" in s]
+    if not sharded:
+        return
+    if len(sharded) != len(shards):
+        raise RuntimeError("Cannot merge sharded and unsharded dump outputs.")
+    counts = {s["shard"].split("/")[1] for s in sharded}
+    totals = {s.get("shard_total", "") for s in sharded}
+    if len(counts) != 1 or len(totals) != 1:
+        raise RuntimeError("Shards disagree on the number of shards or on the jobs to dump.")
+    count = int(counts.pop())
+    seen = sorted(int(s["shard"].split("/")[0]) for s in sharded)
+    if seen != list(range(1, count + 1)):
+        raise RuntimeError(f"Expected shards 1 to {count}, got {seen}.")
+    units = [u for s in sharded for u in s.get("shard_units", "").split()]
+    if len(units) != len(set(units)) or units_digest(units) != totals.pop():
+        raise RuntimeError("Shards do not cover every job exactly once.")
+
+
+def _get_orphaned_outputs(deleted: Iterable[Path], index: DependencyIndex) -> List[Path]:
+    orphaned = []
+    for d in sorted({f.parent for f in deleted if f.name == CUE_DELIVERY_FILE}):
+        if d in index.delivery_dirs:
+            continue
+        orphaned.append(Path(str(d) + ".yaml"))
+    return orphaned
+
+
 def _get_changed_dir_from_prefix(prefix: str) -> List[Path]:
     dirs = []
     prefix_dir = Path("/".join(prefix.split("/")[:-1]))
@@ -139,9 +463,107 @@ def _get_changed_dir_from_prefix(prefix: str) -> List[Path]:
     return dirs
 
 
+def _plan_dump(
+    cue_dir: Set[Path],
+    avro_files: Set[Path],
+    index: DependencyIndex,
+    dump_cache: Optional[DumpCache],
+    debug: bool,
+    batch: bool,
+    batch_size: int,
+    avro_batch: bool,
+    avro_tools: str,
+) -> Tuple[List[DumpOutput], List[Job]]:
+    outputs: List[DumpOutput] = []
+    keys: Dict[Path, str] = {}
+    if dump_cache is not None:
+        outputs, keys = _restore_cached_dumps(cue_dir, index, dump_cache)
+        cue_dir = set(keys)
+        for a in sorted(avro_files):
+            config_map = read_avro_fingerprint(a)
+            if config_map is not None:
+                LOGGER.debug(f"unchanged: {a}")
+                outputs.append(DumpOutput(config_map, OUTPUT_UNCHANGED))
+                avro_files.discard(a)
+
+    fingerprint = dump_cache is not None
+    jobs = []
+    if avro_batch and avro_files:
+        idl_cmd = _build_avro_idl_batch_command(avro_files, avro_tools)
+        idl_names = [f"avro:{a.resolve().relative_to(BASE_DIR)}" for a in avro_files]
+        if debug:
+            jobs.append(Job(AVRO_IDL_BATCH_JOB, _eval, (idl_cmd,), idl_names))
+        else:
+            jobs.append(Job(AVRO_IDL_BATCH_JOB, _gen_avro_schemata, (idl_cmd,), idl_names))
+    for a in avro_files:
+        schema_cmd = _build_avro_avsc_command(a)
+        if avro_batch:
+            name = f"avsc:{a.resolve().relative_to(BASE_DIR)}"
+            depends = [AVRO_IDL_BATCH_JOB]
+            if debug:
+                jobs.append(Job(name, _eval, (schema_cmd,), depends=depends))
+            else:
+                args = (schema_cmd, a, fingerprint)
+                jobs.append(Job(name, _gen_avro_config_map, args, depends=depends))
+            continue
+        idl_cmd = _build_avro_avdl_command(a)
+        name = f"avro:{a.resolve().relative_to(BASE_DIR)}"
+        if debug:
+            jobs.append(Job(name, _eval, (idl_cmd, schema_cmd)))
+        else:
+            jobs.append(Job(name, _gen_avro, (idl_cmd, schema_cmd, a, fingerprint)))
+
+    if batch and not debug:
+        for b in _group_dump_batches(cue_dir, batch_size):
+            names = [f"dump:{c.resolve().relative_to(BASE_DIR)}" for c in b]
+            name = names[0] if len(names) == 1 else f"{names[0]} (+{len(names) - 1})"
+            jobs.append(Job(name, _dump_batch, (b, index, dump_cache, keys), names))
+    else:
+        for c in cue_dir:
+            cmd = _build_dump_command(c, debug)
+            if debug:
+                name = f"eval:{c.resolve().relative_to(BASE_DIR)}"
+                jobs.append(Job(name, _eval, (cmd,)))
+            else:
+                name = f"dump:{c.resolve().relative_to(BASE_DIR)}"
+                output = str(c.resolve()) + ".yaml"
+                jobs.append(Job(name, _dump, (cmd, output, dump_cache, keys.get(c))))
+    return outputs, jobs
+
+
+def _collect_outputs(results: List[JobResult]) -> List[DumpOutput]:
+    outputs = []
+    for r in results:
+        if isinstance(r.result, list):
+            outputs.extend(r.result)
+        else:
+            outputs.append(r.result)
+    return outputs
+
+
 @cue.command()
-@click.option("--max-worker", type=int, required=False, default=10)
+@click.option(
+    "--max-worker", type=int, required=False, help="Defaults to the number of CPUs", default=None
+)
+@click.option(
+    "--memory-budget",
+    type=int,
+    required=False,
+    help="MiB shared by running jobs, admitted by their peak RSS recorded in --stats-file",
+)
 @click.option("--debug", is_flag=True, default=False)
+@click.option(
+    "--batch/--no-batch",
+    default=False,
+    help="Evaluate delivery dirs sharing the same ancestor dirs in one cue process",
+)
+@click.option("--batch-size", type=int, default=50)
+@click.option(
+    "--avro-batch/--no-avro-batch",
+    default=True,
+    help="Compile all changed Avro IDL files in a single JVM",
+)
+@click.option("--avro-tools", type=str, default=AVRO_TOOLS_JAR, help="Path to avro-tools.jar")
 @click.option(
     "--file",
     type=click.Path(exists=True, dir_okay=True, file_okay=True, resolve_path=True, path_type=Path),
@@ -152,6 +574,61 @@ def _get_changed_dir_from_prefix(prefix: str) -> List[Path]:
     type=str,
     required=False,
 )
+@click.option(
+    "--since",
+    type=str,
+    required=False,
+    help="Dump what changed between <ref> and HEAD according to git, including deletions",
+)
+@click.option(
+    "--shard",
+    type=str,
+    required=False,
+    callback=validate_shard,
+    help="i/N: dump only the i-th of N shards, assigned by a hash of each job",
+)
+@click.option(
+    "--keep-going",
+    is_flag=True,
+    default=False,
+    help="Run every job even if some fail, then report all failures. "
+    "By default the first failure cancels pending jobs and terminates running ones",
+)
+@click.option(
+    "--only-changed",
+    is_flag=True,
+    default=False,
+    help="Print only new or changed outputs in cue_files=",
+)
+@click.option(
+    "--split-resources",
+    is_flag=True,
+    default=False,
+    help="Also write every resource to <dir>.resources/<kind>/<namespace>/<name>.yaml "
+    "and an index with content hashes to <dir>.index.json",
+)
+@click.option(
+    "--profile", is_flag=True, default=False, help="Print a cProfile summary of the orchestration"
+)
+@click.option(
+    "--report-json",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True, path_type=Path),
+    required=False,
+    help="Write wall/CPU time, peak RSS, queue wait and output size of every job",
+)
+@click.option("--cache/--no-cache", default=True, help="Reuse outputs of unchanged inputs")
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, dir_okay=True, resolve_path=True, path_type=Path),
+    default=CUE_CACHE_DIR,
+)
+@click.option("--cache-max-size", type=int, default=CUE_CACHE_MAX_SIZE, help="Size in bytes")
+@click.option(
+    "--stats-file",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True, path_type=Path),
+    default=CUE_STATS_FILE,
+    help="Durations of earlier runs used to start the most expensive jobs first",
+)
 @click.argument(
     "inputs",
     type=click.Path(exists=True, dir_okay=True, file_okay=True, resolve_path=True, path_type=Path),
@@ -159,39 +636,351 @@ def _get_changed_dir_from_prefix(prefix: str) -> List[Path]:
 )
 @click.pass_obj
 def dump(
-    ctx: ContextArgument, debug: bool, max_worker, file: Path, prefix: str, inputs: Iterable[Path]
+    ctx: ContextArgument,
+    debug: bool,
+    batch: bool,
+    batch_size: int,
+    avro_batch: bool,
+    avro_tools: str,
+    max_worker,
+    memory_budget: Optional[int],
+    file: Path,
+    prefix: str,
+    since: Optional[str],
+    shard: Optional[Tuple[int, int]],
+    keep_going: bool,
+    only_changed: bool,
+    split_resources: bool,
+    profile: bool,
+    report_json: Optional[Path],
+    cache: bool,
+    cache_dir: Path,
+    cache_max_size: int,
+    stats_file: Path,
+    inputs: Iterable[Path],
 ) -> None:
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    start = time.monotonic()
+
     inputs = list(inputs)
     if file:
         inputs.extend(_read_changed_file(file))
     if prefix:
         inputs.extend(_get_changed_dir_from_prefix(prefix))
+    deleted: List[Path] = []
+    if since:
+        changes = get_git_changes(since)
+        inputs.extend(changes.changed)
+        deleted = changes.deleted
 
     changed_dir = get_changed_dir(inputs)
-    cue_dir = get_changed_cue_dir(changed_dir)
+    index = DependencyIndex.build()
+    cue_dir = index.affected_delivery_dirs(inputs + deleted)
+    orphaned_files = _get_orphaned_outputs(deleted, index)
     avro_files = get_changed_avro_files(changed_dir)
+    job_stats = JobStats(stats_file)
+    units: Dict[str, Path] = {}
+    selected: Set[str] = set()
+    if shard:
+        units = _shard_units(cue_dir, avro_files)
+        selected = select_shard(units, shard[0], shard[1])
+        click.echo(f"shard {shard[0]}/{shard[1]}: {len(selected)} of {len(units)} jobs", err=True)
+        cue_dir = {c for k, c in units.items() if k in selected and c in cue_dir}
+        avro_files = {a for k, a in units.items() if k in selected and a in avro_files}
+    delivery_dirs = sorted(cue_dir)
 
-    outputs = []
-    with ThreadPoolExecutor(max_workers=max_worker) as e:
-        fs = []
-        for a in avro_files:
-            idl_cmd = _build_avro_avdl_command(a)
-            schema_cmd = _build_avro_avsc_command(a)
-            if debug:
-                exec_command(idl_cmd, echo=True)
-                exec_command(schema_cmd, echo=True)
-            else:
-                fs.append(e.submit(_gen_avro, idl_cmd, schema_cmd))
+    dump_cache = None
+    if cache and not debug:
+        dump_cache = DumpCache(cache_dir, cache_max_size, salt=dump_cache_salt())
+    outputs, jobs = _plan_dump(
+        cue_dir, avro_files, index, dump_cache, debug, batch, batch_size, avro_batch, avro_tools
+    )
 
-        for c in cue_dir:
-            cmd = _build_dump_command(c, debug)
-            if debug:
-                exec_command(cmd, echo=True)
-            else:
-                output = str(c.resolve()) + ".yaml"
-                fs.append(e.submit(_dump, cmd, output))
+    try:
+        budget = memory_budget * 1024 if memory_budget else None
+        results = run_jobs(jobs, max_worker, job_stats, keep_going, budget)
+    except JobsFailed as e:
+        _echo_job_failures(e)
+        raise RuntimeError("cue dump failed.") from None
+    finally:
+        job_stats.save()
+        if dump_cache is not None:
+            dump_cache.evict()
+    if debug:
+        _echo_eval_results(results)
+    else:
+        outputs.extend(_collect_outputs(results))
+
+    wall_time = time.monotonic() - start
+    profile_summary = None
+    if profiler is not None:
+        profiler.disable()
+        profile_summary = _format_profile(profiler)
+        click.echo(profile_summary, err=True)
+    if report_json:
+        _write_report(report_json, results, wall_time, profile_summary)
+
+    resource_files = []
+    if split_resources and not debug:
+        for c in delivery_dirs:
+            resource_files.extend(split_manifest(Path(str(c.resolve()) + ".yaml")))
+
+    statuses = collections.Counter(o.status for o in outputs)
+    click.echo(
+        f"outputs: changed={statuses[OUTPUT_CHANGED]} unchanged={statuses[OUTPUT_UNCHANGED]} "
+        f"new={statuses[OUTPUT_NEW]}",
+        err=True,
+    )
+    if only_changed:
+        outputs = [o for o in outputs if o.status != OUTPUT_UNCHANGED]
+    if dump_cache is not None:
+        click.echo(dump_cache.summary(), err=True)
+    if results:
+        click.echo(format_critical_path(results), err=True)
+    for f in orphaned_files:
+        click.echo(f"orphaned: {f}", err=True)
+    click.echo(f"cue_files={' '.join(o.path for o in outputs)}")
+    if split_resources and not debug:
+        click.echo(f"resource_files={' '.join(resource_files)}")
+    if since:
+        click.echo(f"orphaned_files={' '.join(str(f) for f in orphaned_files)}")
+    if shard:
+        # Lets cue merge check that the shards together dumped every job.
+        click.echo(f"shard={shard[0]}/{shard[1]}")
+        click.echo(f"shard_total={units_digest(units)}")
+        click.echo(f"shard_units={' '.join(sorted(selected))}")
+
+
+@cue.command()
+@click.argument(
+    "outputs",
+    type=click.Path(exists=True, dir_okay=False, file_okay=True, path_type=Path),
+    nargs=-1,
+)
+def merge(outputs: Iterable[Path]) -> None:
+    merged: Dict[str, List[str]] = {}
+    shards = []
+    for output in outputs:
+        shard: Dict[str, str] = {}
+        for line in output.read_text(encoding="utf-8").splitlines():
+            key, sep, value = line.partition("=")
+            if sep and key in MERGE_OUTPUT_KEYS:
+                files = merged.setdefault(key, [])
+                files.extend(f for f in value.split() if f not in files)
+            elif sep and key in SHARD_OUTPUT_KEYS:
+                shard[key] = value
+        shards.append(shard)
+    _check_shards(shards)
+    for key in MERGE_OUTPUT_KEYS:
+        if key in merged:
+            click.echo(f"{key}={' '.join(merged[key])}")
+
+
+def _snapshot(roots: Iterable[Path]) -> Dict[Path, Tuple[int, int]]:
+    files = {}
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for f in filenames:
+                if f.endswith(WATCH_SUFFIXES):
+                    file = Path(dirpath) / f
+                    try:
+                        stat = file.stat()
+                    except FileNotFoundError:
+                        continue
+                    files[file] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def _changed_files(
+    previous: Dict[Path, Tuple[int, int]], current: Dict[Path, Tuple[int, int]]
+) -> Set[Path]:
+    changed = {f for f, s in current.items() if previous.get(f) != s}
+    changed.update(f for f in previous if f not in current)
+    return changed
+
+
+def _rebuild(
+    changed: Set[Path],
+    index: DependencyIndex,
+    dump_cache: DumpCache,
+    job_stats: JobStats,
+    max_worker: Optional[int],
+    batch: bool,
+    batch_size: int,
+    avro_tools: str,
+) -> None:
+    get_snapshot.cache_clear()
+    start = time.monotonic()
+    try:
+        # cue.mod/ is not watched, a rebuild picks up its changes for the dirs it dumps.
+        dump_cache.salt = dump_cache_salt()
+        index.update({c.parent for c in changed})
+        cue_dir = index.affected_delivery_dirs(changed)
+        avro_files = {c for c in changed if c.match(AVRO_AVDL_FILE) and c.exists()}
+        click.echo(
+            f"changed: {len(changed)} files, {len(cue_dir)} delivery dirs, "
+            f"{len(avro_files)} avro",
+            err=True,
+        )
+        outputs, jobs = _plan_dump(
+            cue_dir, avro_files, index, dump_cache, False, batch, batch_size, True, avro_tools
+        )
+        outputs.extend(_collect_outputs(run_jobs(jobs, max_worker, job_stats, keep_going=True)))
+    except JobsFailed as e:
+        _echo_job_failures(e)
+        click.echo("rebuild failed", err=True)
+        return
+    except RuntimeError as e:
+        click.echo(f"rebuild failed: {e}", err=True)
+        return
+    except Exception as e:
+        # A file removed mid-edit and the like. The watcher keeps running, the next save
+        # rebuilds the dirs again.
+        LOGGER.exception(e)
+        click.echo(f"rebuild failed: {e!r}", err=True)
+        return
+    finally:
+        dump_cache.evict()
+    for o in outputs:
+        if o.status != OUTPUT_UNCHANGED:
+            click.echo(f"  {o.status}: {o.path}", err=True)
+    click.echo(f"rebuilt in {time.monotonic() - start:.2f}s, {dump_cache.summary()}", err=True)
+
+
+@cue.command()
+@click.option(
+    "--max-worker", type=int, required=False, help="Defaults to the number of CPUs", default=None
+)
+@click.option("--interval", type=float, default=0.5, help="Seconds between polls")
+@click.option(
+    "--debounce", type=float, default=0.3, help="Seconds without saves before a rebuild starts"
+)
+@click.option("--batch/--no-batch", default=False)
+@click.option("--batch-size", type=int, default=50)
+@click.option("--avro-tools", type=str, default=AVRO_TOOLS_JAR, help="Path to avro-tools.jar")
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, dir_okay=True, resolve_path=True, path_type=Path),
+    default=CUE_CACHE_DIR,
+)
+@click.option("--cache-max-size", type=int, default=CUE_CACHE_MAX_SIZE, help="Size in bytes")
+@click.option(
+    "--stats-file",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True, path_type=Path),
+    default=CUE_STATS_FILE,
+)
+@click.pass_obj
+def watch(
+    ctx: ContextArgument,
+    max_worker: Optional[int],
+    interval: float,
+    debounce: float,
+    batch: bool,
+    batch_size: int,
+    avro_tools: str,
+    cache_dir: Path,
+    cache_max_size: int,
+    stats_file: Path,
+) -> None:
+    roots = [CUE_MANIFESTS_DIR, CUE_PKG_DIR]
+    # The index and the cache live for the whole session so that a rebuild only pays for the
+    # delivery dirs affected by the saved files.
+    index = DependencyIndex.build()
+    dump_cache = DumpCache(cache_dir, cache_max_size, salt=dump_cache_salt())
+    job_stats = JobStats(stats_file)
+    previous = _snapshot(roots)
+    click.echo(f"watching {len(previous)} files, press Ctrl+C to stop", err=True)
+    try:
+        while True:
+            time.sleep(interval)
+            current = _snapshot(roots)
+            if current == previous:
+                continue
+            # Wait for a burst of saves to settle before rebuilding.
+            while True:
+                time.sleep(debounce)
+                latest = _snapshot(roots)
+                if latest == current:
+                    break
+                current = latest
+            changed = _changed_files(previous, current)
+            previous = current
+            _rebuild(
+                changed, index, dump_cache, job_stats, max_worker, batch, batch_size, avro_tools
+            )
+            job_stats.save()
+    except KeyboardInterrupt:
+        pass
+
+
+def _upload_file(store: ObjectStore, ledger: UploadLedger, file: Path, name: str) -> bool:
+    checksum = crc32c(file)
+    if ledger.get(name) == checksum:
+        return False
+    LOGGER.debug(f"upload: {file} -> {store.url}/{name}")
+    store.upload(file, name)
+    ledger.update(name, checksum)
+    return True
+
+
+@cue.command()
+@click.option(
+    "--destination", type=str, required=True, help="gs://<bucket>/<prefix> or a local directory"
+)
+@click.option("--exclude", type=str, required=False, help="Regex of paths not to upload")
+@click.option(
+    "--max-worker", type=int, required=False, help="Defaults to the number of CPUs", default=None
+)
+@click.option(
+    "--ledger",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True, path_type=Path),
+    required=False,
+    help="CRC32C of uploaded files, defaults to a file per destination under .cache/upload",
+)
+@click.option(
+    "--refresh-ledger", is_flag=True, default=False, help="Rebuild the ledger from the destination"
+)
+@click.argument(
+    "source",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False, resolve_path=True, path_type=Path),
+    default=CUE_MANIFESTS_DIR,
+)
+@click.pass_obj
+def upload(
+    ctx: ContextArgument,
+    destination: str,
+    exclude: Optional[str],
+    max_worker: Optional[int],
+    ledger: Optional[Path],
+    refresh_ledger: bool,
+    source: Path,
+) -> None:
+    store = get_object_store(destination)
+    upload_ledger = UploadLedger(ledger or UploadLedger.default_file(CUE_UPLOAD_LEDGER_DIR, store))
+    if refresh_ledger or not upload_ledger.load():
+        LOGGER.info(f"Listing {store.url}")
+        upload_ledger.checksums = store.list()
 
-        for f in concurrent.futures.as_completed(fs):
-            outputs.append(f.result())
+    cwd = os.getcwd()
+    pattern = re.compile(exclude) if exclude else None
+    jobs = []
+    for dirpath, _, filenames in os.walk(source):
+        for f in filenames:
+            file = Path(dirpath) / f
+            if pattern and pattern.match(str(file).replace(cwd, "")):
+                continue
+            if is_avro_fingerprint_file(f):
+                continue
+            name = str(file.relative_to(source))
+            jobs.append(Job(name, _upload_file, (store, upload_ledger, file, name)))
 
-    click.echo(f"cue_files={' '.join(outputs)}")
+    try:
+        results = run_jobs(jobs, max_worker)
+    finally:
+        upload_ledger.save()
+    uploaded = sorted(r.job.name for r in results if r.result)
+    for u in uploaded:
+        click.echo(f"{store.url}/{u}", err=True)
+    click.echo(f"uploaded={len(uploaded)} skipped={len(results) - len(uploaded)}", err=True)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from dataplatform_kubernetes import (
+    BASE_DIR,
+    CUE_DELIVERY_FILE,
+    CUE_MANIFESTS_DIR,
+    CUE_MODULE_PATH,
+    CUE_PKG_DIR,
+)
+from dataplatform_kubernetes.snapshot import RepositorySnapshot, get_snapshot
+
+PACKAGE_PATTERN = re.compile(r"^package\s+([A-Za-z_][A-Za-z0-9_]*)")
+IMPORT_SPEC_PATTERN = re.compile(r'^(?:[A-Za-z_][A-Za-z0-9_]*\s+)?"(?P<path>[^"]+)"')
+
+
+@dataclass
+class CueFileHeader:
+    package: Optional[str] = None
+    imports: List[str] = field(default_factory=list)
+
+
+def parse_cue_header(file: Path) -> CueFileHeader:
+    header = CueFileHeader()
+    in_block = False
+    with file.open("rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("//", 1)[0].strip()
+            if not line:
+                continue
+            if in_block:
+                if line.startswith(")"):
+                    in_block = False
+                    continue
+                match = IMPORT_SPEC_PATTERN.match(line)
+                if match:
+                    header.imports.append(match.group("path"))
+                continue
+            match = PACKAGE_PATTERN.match(line)
+            if match:
+                header.package = match.group(1)
+                continue
+            if line.startswith("import"):
+                spec = line[len("import") :].strip()
+                if spec.startswith("("):
+                    in_block = True
+                    spec = spec[1:].strip()
+                    if spec.endswith(")"):
+                        in_block = False
+                        spec = spec[:-1].strip()
+                match = IMPORT_SPEC_PATTERN.match(spec)
+                if match:
+                    header.imports.append(match.group("path"))
+                continue
+            if line.startswith("@"):
+                continue
+            # Imports must precede every other declaration, so the header ends here.
+            break
+    return header
+
+
+def import_path_to_dir(import_path: str) -> Optional[Path]:
+    if not import_path.startswith(CUE_MODULE_PATH + "/"):
+        return None
+    relative = import_path[len(CUE_MODULE_PATH) + 1 :].split(":", 1)[0]
+    return BASE_DIR / relative
+
+
+class DependencyIndex:
+    def __init__(self) -> None:
+        self.packages: Dict[Path, Set[str]] = {}
+        self.imports: Dict[Path, Set[Path]] = {}
+        self.delivery_dirs: Set[Path] = set()
+        self._importers: Dict[Path, Set[Path]] = {}
+
+    @staticmethod
+    def build(roots: Optional[Iterable[Path]] = None) -> "DependencyIndex":
+        index = DependencyIndex()
+        snapshot = get_snapshot() if roots is None else RepositorySnapshot.build(roots)
+        for dir, cue_files in snapshot.cue_files.items():
+            index.add_dir(dir, cue_files)
+        index.link()
+        return index
+
+    def add_dir(self, dir: Path, cue_files: Iterable[str]) -> None:
+        packages: Set[str] = set()
+        imports: Set[Path] = set()
+        for f in cue_files:
+            header = parse_cue_header(dir / f)
+            if header.package:
+                packages.add(header.package)
+            for i in header.imports:
+                imported = import_path_to_dir(i)
+                if imported is not None:
+                    imports.add(imported)
+            if f == CUE_DELIVERY_FILE and CUE_MANIFESTS_DIR in dir.parents:
+                self.delivery_dirs.add(dir)
+        self.packages[dir] = packages
+        self.imports[dir] = imports
+
+    def update(self, dirs: Iterable[Path]) -> None:
+        for dir in dirs:
+            self.packages.pop(dir, None)
+            self.imports.pop(dir, None)
+            self.delivery_dirs.discard(dir)
+            cue_files = [f.name for f in dir.glob("*.cue")] if dir.is_dir() else []
+            if cue_files:
+                self.add_dir(dir, cue_files)
+        self.link()
+
+    def link(self) -> None:
+        self._importers = {}
+        for dir, imports in self.imports.items():
+            for i in imports:
+                for d in self.package_dirs(i):
+                    self._importers.setdefault(d, set()).add(dir)
+
+    def package_dirs(self, dir: Path) -> List[Path]:
+        # A CUE package also contains the files of its ancestor directories within the module
+        # that declare the same package name.
+        dirs = [dir]
+        packages = self.packages.get(dir, set())
+        parent = dir.parent
+        while parent != BASE_DIR and BASE_DIR in parent.parents:
+            if self.packages.get(parent, set()) & packages:
+                dirs.append(parent)
+            parent = parent.parent
+        return dirs
+
+    def ancestor_dirs(self, dir: Path) -> List[Path]:
+        dirs = []
+        while dir != BASE_DIR and BASE_DIR in dir.parents:
+            if dir in self.packages:
+                dirs.append(dir)
+            dir = dir.parent
+        return dirs
+
+    def dependency_dirs(self, delivery_dir: Path) -> List[Path]:
+        return self._import_closure(self.ancestor_dirs(delivery_dir.resolve()))
+
+    def file_dependency_dirs(self, file: Path) -> List[Path]:
+        # Package dirs imported by a file outside the index, such as a tool file.
+        imported = [import_path_to_dir(i) for i in parse_cue_header(file).imports]
+        return self._import_closure(
+            [d for i in imported if i is not None for d in self.package_dirs(i)]
+        )
+
+    def _import_closure(self, dirs: List[Path]) -> List[Path]:
+        seen: Set[Path] = set()
+        ordered: List[Path] = []
+        stack = list(reversed(dirs))
+        while stack:
+            d = stack.pop()
+            if d in seen:
+                continue
+            seen.add(d)
+            ordered.append(d)
+            for i in sorted(self.imports.get(d, set()), reverse=True):
+                stack.extend(reversed(self.package_dirs(i)))
+        return ordered
+
+    def affected_dirs(self, changed: Iterable[Path]) -> Set[Path]:
+        affected: Set[Path] = set()
+        stack: List[Path] = []
+        roots = [CUE_MANIFESTS_DIR.resolve(), CUE_PKG_DIR.resolve()]
+        for c in changed:
+            c = c.resolve()
+            # Files outside manifests/ and pkg/, e.g. pyproject.toml, affect no delivery dir. Their
+            # parent would be BASE_DIR, which is an ancestor of every delivery dir.
+            if not any(c == r or r in c.parents for r in roots):
+                continue
+            if c.is_dir():
+                stack.append(c)
+                stack.extend(d for d in self.packages if c in d.parents)
+            else:
+                stack.append(c.parent)
+        while stack:
+            d = stack.pop()
+            if d in affected:
+                continue
+            affected.add(d)
+            stack.extend(self._importers.get(d, set()))
+        return affected
+
+    def affected_delivery_dirs(self, changed: Iterable[Path]) -> Set[Path]:
+        affected = self.affected_dirs(changed)
+        delivery_dirs = set()
+        for d in self.delivery_dirs:
+            if d in affected or any(p in affected for p in d.parents):
+                delivery_dirs.add(d)
+        return delivery_dirs
@@ -3,21 +3,24 @@
 import os
 import re
 import textwrap
-from typing import Iterable
+from typing import TYPE_CHECKING, Iterable
 
 import click
 from dataplatform_kubernetes import ContextArgument
-from github import Github
-from github.Repository import Repository
 from jinja2 import Template
 
+if TYPE_CHECKING:
+    from github.Repository import Repository
+
 
 @click.group
 def github() -> None:
     pass
 
 
-def _get_repo() -> Repository:
+def _get_repo() -> "Repository":
+    from github import Github
+
     g = Github(os.environ["GITHUB_TOKEN"])
     return g.get_repo(os.environ["GITHUB_REPOSITORY"])
 
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List
+
+import yaml
+from dataplatform_kubernetes import LOGGER
+from dataplatform_kubernetes.util import OUTPUT_UNCHANGED, write_if_changed
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+CLUSTER_SCOPE = "_cluster"
+RESOURCE_DIR_SUFFIX = ".resources"
+RESOURCE_INDEX_SUFFIX = ".index.json"
+
+
+@dataclass
+class ResourceEntry:
+    api_version: str
+    kind: str
+    namespace: str
+    name: str
+    path: str
+    sha256: str
+
+
+def resource_dir(manifest: Path) -> Path:
+    return manifest.with_name(manifest.stem + RESOURCE_DIR_SUFFIX)
+
+
+def resource_index(manifest: Path) -> Path:
+    return manifest.with_name(manifest.stem + RESOURCE_INDEX_SUFFIX)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _resource_path(resource: Dict[str, Any]) -> Path:
+    metadata = resource.get("metadata") or {}
+    namespace = metadata.get("namespace") or CLUSTER_SCOPE
+    return Path(resource["kind"]) / namespace / f"{metadata['name']}.yaml"
+
+
+def _read_index(index_file: Path) -> Dict[str, Any]:
+    if not index_file.exists():
+        return {}
+    try:
+        with index_file.open("rt", encoding="utf-8") as f:
+            index: Dict[str, Any] = json.load(f)
+            return index
+    except ValueError:
+        LOGGER.warning(f"Ignore broken resource index: {index_file}")
+        return {}
+
+
+def split_manifest(manifest: Path) -> List[str]:
+    data = manifest.read_bytes()
+    digest = _sha256(data)
+    index_file = resource_index(manifest)
+    output_dir = resource_dir(manifest)
+    index = _read_index(index_file)
+    if index.get("sha256") == digest and all(
+        (output_dir / r["path"]).exists() for r in index.get("resources", [])
+    ):
+        return []
+
+    changed = []
+    entries = []
+    for resource in yaml.load_all(data, Loader=SafeLoader):
+        if not resource:
+            continue
+        metadata = resource.get("metadata") or {}
+        if not resource.get("kind") or not metadata.get("name"):
+            # generateName only resources and List kinds have no name to write them under.
+            LOGGER.warning(f"Skip resource without kind or metadata.name in {manifest}")
+            continue
+        path = _resource_path(resource)
+        contents = yaml.dump(resource, Dumper=SafeDumper, sort_keys=True)
+        if write_if_changed(output_dir / path, contents) != OUTPUT_UNCHANGED:
+            changed.append(str(output_dir / path))
+        entries.append(
+            ResourceEntry(
+                api_version=resource.get("apiVersion", ""),
+                kind=resource["kind"],
+                namespace=metadata.get("namespace") or CLUSTER_SCOPE,
+                name=metadata["name"],
+                path=str(path),
+                sha256=_sha256(contents.encode("utf-8")),
+            )
+        )
+
+    # Remove resources that are no longer part of the manifest.
+    current = {output_dir / e.path for e in entries}
+    for previous in index.get("resources", []):
+        stale = output_dir / previous["path"]
+        if stale not in current and stale.exists():
+            LOGGER.debug(f"remove: {stale}")
+            os.unlink(stale)
+
+    contents = json.dumps(
+        {"manifest": manifest.name, "sha256": digest, "resources": [asdict(e) for e in entries]},
+        separators=(",", ":"),
+    )
+    if write_if_changed(index_file, contents) != OUTPUT_UNCHANGED:
+        changed.append(str(index_file))
+    return changed
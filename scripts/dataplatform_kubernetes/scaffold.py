@@ -2,8 +2,9 @@
 # -*- coding: utf-8 -*-
 import textwrap
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import click
 from dataplatform_kubernetes import (
@@ -13,11 +14,19 @@ from dataplatform_kubernetes import (
     ContextArgument,
 )
 from dataplatform_kubernetes.validation import validate_project_id, validate_service_id
-from jinja2 import Environment, FileSystemLoader
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
 
 RESOURCE_DIR = BASE_DIR / "scripts" / "resources" / "scaffold"
 TEMPLATE_DIR = RESOURCE_DIR / "template"
-TEMPLATE_ENV = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+
+
+@lru_cache(maxsize=None)
+def _get_template_env() -> "Environment":
+    from jinja2 import Environment, FileSystemLoader
+
+    return Environment(loader=FileSystemLoader(TEMPLATE_DIR))
 
 
 @dataclass
@@ -108,7 +117,7 @@ def _get_env_dir(config: ScaffoldConfig, mkdir=True) -> Path:
 
 def _generate_metadata_cue_files(config: ScaffoldConfig) -> None:
     base_dir = _get_base_dir(config)
-    template_metadata = TEMPLATE_ENV.get_template("metadata.cue.jinja2")
+    template_metadata = _get_template_env().get_template("metadata.cue.jinja2")
     metadata_file = base_dir / "metadata.cue"
     if not metadata_file.exists():
         with open(metadata_file, "wt", encoding="utf-8") as f:
@@ -116,7 +125,7 @@ def _generate_metadata_cue_files(config: ScaffoldConfig) -> None:
             f.write("\n")
 
     env_dir = _get_env_dir(config)
-    template_metadata_env = TEMPLATE_ENV.get_template("env/metadata.cue.jinja2")
+    template_metadata_env = _get_template_env().get_template("env/metadata.cue.jinja2")
     metadata_env_file = env_dir / "metadata.cue"
     if not metadata_env_file.exists():
         with open(metadata_env_file, "wt", encoding="utf-8") as f:
@@ -124,14 +133,14 @@ def _generate_metadata_cue_files(config: ScaffoldConfig) -> None:
             f.write("\n")
 
     if config.type == "spanner":
-        template_database = TEMPLATE_ENV.get_template("env/spanner.cue.jinja2")
+        template_database = _get_template_env().get_template("env/spanner.cue.jinja2")
         database_file = env_dir / "spanner.cue"
         if not database_file.exists():
             with open(database_file, "wt", encoding="utf-8") as f:
                 f.write(template_database.render(config=config))
                 f.write("\n")
     elif config.type == "cloudsql":
-        template_database = TEMPLATE_ENV.get_template("env/cloudsql.cue.jinja2")
+        template_database = _get_template_env().get_template("env/cloudsql.cue.jinja2")
         database_file = env_dir / "cloudsql.cue"
         if not database_file.exists():
             with open(database_file, "wt", encoding="utf-8") as f:
@@ -149,7 +158,7 @@ def _generate_spanner_cue_files(config: ScaffoldSpannerConfig) -> None:
         ("delivery.cue", "common/delivery.cue.jinja2"),
         ("semaphore.cue", "common/semaphore.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((common_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -169,7 +178,7 @@ def _generate_spanner_cue_files(config: ScaffoldSpannerConfig) -> None:
         ("workflow_daily.cue", "spanner/workflow_daily.cue.jinja2"),
         ("workflow_hourly.cue", "spanner/workflow_hourly.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((query_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -185,7 +194,7 @@ def _generate_cloudsql_cue_files(config: ScaffoldCloudSqlConfig) -> None:
         ("delivery.cue", "common/delivery.cue.jinja2"),
         ("semaphore.cue", "common/semaphore.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((common_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -205,7 +214,7 @@ def _generate_cloudsql_cue_files(config: ScaffoldCloudSqlConfig) -> None:
         ("workflow_daily.cue", "cloudsql/workflow_daily.cue.jinja2"),
         ("workflow_hourly.cue", "cloudsql/workflow_hourly.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((query_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -214,7 +223,7 @@ def _generate_cloudsql_cue_files(config: ScaffoldCloudSqlConfig) -> None:
 def _generate_beyond_cue_files(config: ScaffoldBeyondConfig) -> None:
     env_dir = _get_env_dir(config)
     # metadata
-    template_metadata_env = TEMPLATE_ENV.get_template("beyond/database.cue.jinja2")
+    template_metadata_env = _get_template_env().get_template("beyond/database.cue.jinja2")
     metadata_env_file = env_dir / f"{config.cloudsql_database}.cue"
     if not metadata_env_file.exists():
         with open(metadata_env_file, "wt", encoding="utf-8") as f:
@@ -226,14 +235,14 @@ def _generate_beyond_cue_files(config: ScaffoldBeyondConfig) -> None:
     for name, path in [
         (f"{config.cloudsql_database}.cue", "beyond/common.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((common_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
     # database
     database_dir = env_dir / config.cloudsql_database
     database_dir.mkdir(parents=True, exist_ok=True)
-    template_metadata_database = TEMPLATE_ENV.get_template("beyond/metadata.cue.jinja2")
+    template_metadata_database = _get_template_env().get_template("beyond/metadata.cue.jinja2")
     metadata_database_file = database_dir / "metadata.cue"
     if not metadata_database_file.exists():
         with open(metadata_database_file, "wt", encoding="utf-8") as f:
@@ -255,7 +264,7 @@ def _generate_beyond_cue_files(config: ScaffoldBeyondConfig) -> None:
         ("workflow_daily.cue", "beyond/workflow_daily.cue.jinja2"),
         ("workflow_hourly.cue", "beyond/workflow_hourly.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((query_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -269,7 +278,7 @@ def _generate_access_log_cue_files(config: ScaffoldAccessLogConfig) -> None:
         ("access_log_to_bigquery.cue", "access_log/access_log_to_bigquery.cue.jinja2"),
         ("delivery.cue", "access_log/delivery.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((output_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -283,7 +292,7 @@ def _generate_event_log_cue_files(config: ScaffoldEventLogConfig) -> None:
         ("event_log_to_bigquery.cue", "event_log/event_log_to_bigquery.cue.jinja2"),
         ("delivery.cue", "event_log/delivery.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((output_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -297,7 +306,7 @@ def _generate_event_log_router_cue_files(config: ScaffoldConfig) -> None:
         ("event_log_router.cue", "event_log_router/event_log_router.cue.jinja2"),
         ("delivery.cue", "event_log_router/delivery.cue.jinja2"),
     ]:
-        template = TEMPLATE_ENV.get_template(path)
+        template = _get_template_env().get_template(path)
         with open((output_dir / name), "wt", encoding="utf-8") as f:
             f.write(template.render(config=config))
             f.write("\n")
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import concurrent
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from dataplatform_kubernetes import LOGGER
+from dataplatform_kubernetes.util import (
+    CommandUsage,
+    reset_commands,
+    start_command_usage,
+    stop_command_usage,
+    terminate_commands,
+)
+
+STATS_SMOOTHING = 0.5
+STATS_DURATIONS = "durations"
+STATS_PEAK_RSS = "peak_rss_kb"
+
+
+@dataclass
+class Job:
+    name: str
+    fn: Callable[..., Any]
+    args: Tuple[Any, ...] = ()
+    keys: List[str] = field(default_factory=list)
+    depends: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.keys:
+            self.keys = [self.name]
+
+
+@dataclass
+class JobResult:
+    job: Job
+    result: Any
+    worker: str
+    queued: float
+    start: float
+    end: float
+    usage: CommandUsage
+    error: Optional[Exception] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def queue_wait(self) -> float:
+        return self.start - self.queued
+
+
+class JobsFailed(RuntimeError):
+    def __init__(self, failures: List[JobResult], results: List[JobResult]) -> None:
+        super().__init__(f"{len(failures)} job(s) failed: {[r.job.name for r in failures]}")
+        self.failures = failures
+        self.results = results
+
+
+def _smooth(values: Dict[str, float], key: str, sample: float) -> None:
+    previous = values.get(key)
+    if previous is None:
+        values[key] = sample
+    else:
+        values[key] = STATS_SMOOTHING * sample + (1 - STATS_SMOOTHING) * previous
+
+
+class JobStats:
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self._durations: Dict[str, float] = {}
+        self._peak_rss: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        if file.exists():
+            try:
+                with file.open("rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data.get(STATS_DURATIONS), dict):
+                    self._durations = {k: float(v) for k, v in data[STATS_DURATIONS].items()}
+                    self._peak_rss = {k: float(v) for k, v in data[STATS_PEAK_RSS].items()}
+                else:
+                    # Files written before peak RSS was recorded only hold durations.
+                    self._durations = {k: float(v) for k, v in data.items()}
+            except (ValueError, TypeError, KeyError, AttributeError):
+                LOGGER.warning(f"Ignore broken stats file: {file}")
+        # Jobs without history are assumed to be as expensive as an average known job.
+        self._default = statistics.mean(self._durations.values()) if self._durations else 0.0
+        self._default_rss = statistics.mean(self._peak_rss.values()) if self._peak_rss else 0.0
+
+    def duration(self, key: str) -> Optional[float]:
+        return self._durations.get(key)
+
+    def key_cost(self, key: str) -> float:
+        return self._durations.get(key, self._default)
+
+    def cost(self, job: Job) -> float:
+        return sum(self.key_cost(k) for k in job.keys)
+
+    def memory(self, job: Job) -> float:
+        # Keys of a job share one process, so its peak is bounded by the heaviest key seen.
+        return max(self._peak_rss.get(k, self._default_rss) for k in job.keys)
+
+    def record(self, job: Job, duration: float, peak_rss: int = 0) -> None:
+        with self._lock:
+            for k in job.keys:
+                _smooth(self._durations, k, duration / len(job.keys))
+                if peak_rss:
+                    _smooth(self._peak_rss, k, peak_rss)
+
+    def save(self) -> None:
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.file.with_suffix(".tmp")
+        with tmp.open("wt", encoding="utf-8") as f:
+            data = {STATS_DURATIONS: self._durations, STATS_PEAK_RSS: self._peak_rss}
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.file)
+
+
+def default_max_worker() -> int:
+    return os.cpu_count() or 1
+
+
+def _run(job: Job, queued: float) -> JobResult:
+    start = time.monotonic()
+    start_command_usage()
+    result = None
+    error = None
+    try:
+        result = job.fn(*job.args)
+    except Exception as e:
+        error = e
+    finally:
+        usage = stop_command_usage()
+    worker = threading.current_thread().name
+    return JobResult(job, result, worker, queued, start, time.monotonic(), usage, error)
+
+
+def run_jobs(
+    jobs: List[Job],
+    max_worker: Optional[int] = None,
+    stats: Optional[JobStats] = None,
+    keep_going: bool = False,
+    memory_budget: Optional[int] = None,
+) -> List[JobResult]:
+    if stats is not None:
+        # Longest processing time first: the most expensive jobs must not be picked up last.
+        jobs = sorted(jobs, key=lambda j: (-stats.cost(j), j.name))
+    workers = max_worker or default_max_worker()
+    now = time.monotonic()
+    queue = [(j, now) for j in jobs if not j.depends]
+    waiting = [j for j in jobs if j.depends]
+    done: Set[str] = set()
+    failed: Set[str] = set()
+    results = []
+    failures = []
+    cancelled = False
+    reserved: Dict[Future[JobResult], float] = {}
+    reset_commands()
+    e = ThreadPoolExecutor(max_workers=workers)
+    try:
+        fs: Set[Future[JobResult]] = set()
+        while True:
+            remaining = []
+            blocked = False
+            for j, queued in queue:
+                memory = 0.0
+                if memory_budget is not None:
+                    # Admit jobs in queue order only while the recorded peak RSS of the running
+                    # jobs fits in the budget. A job heavier than the budget runs alone. Lighter
+                    # jobs behind a job that does not fit wait too, or they would keep taking
+                    # its memory and the expensive job would run last.
+                    memory = stats.memory(j) if stats is not None else 0.0
+                    if (
+                        blocked
+                        or len(fs) >= workers
+                        or (fs and sum(reserved.values()) + memory > memory_budget)
+                    ):
+                        blocked = True
+                        remaining.append((j, queued))
+                        continue
+                f = e.submit(_run, j, queued)
+                fs.add(f)
+                reserved[f] = memory
+            queue = remaining
+            if not fs:
+                break
+            finished, fs = concurrent.futures.wait(fs, return_when=FIRST_COMPLETED)
+            for f in finished:
+                reserved.pop(f, None)
+                if f.cancelled():
+                    continue
+                r = f.result()
+                if r.error is not None:
+                    failed.add(r.job.name)
+                    # Jobs killed by the cancellation below are not failures of their own.
+                    if not cancelled:
+                        failures.append(r)
+                    if not keep_going and not cancelled:
+                        cancelled = True
+                        queue.clear()
+                        for p in fs:
+                            p.cancel()
+                        terminate_commands()
+                    continue
+                if stats is not None:
+                    stats.record(r.job, r.duration, r.usage.max_rss)
+                done.add(r.job.name)
+                results.append(r)
+            if cancelled:
+                continue
+            blocked = [j for j in waiting if any(d in failed for d in j.depends)]
+            while blocked:
+                for j in blocked:
+                    LOGGER.debug(f"skip: {j.name}")
+                    waiting.remove(j)
+                    failed.add(j.name)
+                blocked = [j for j in waiting if any(d in failed for d in j.depends)]
+            ready = [j for j in waiting if all(d in done for d in j.depends)]
+            for j in ready:
+                waiting.remove(j)
+                queue.append((j, time.monotonic()))
+    except KeyboardInterrupt:
+        # Commands run in their own sessions and do not see the terminal's SIGINT.
+        terminate_commands()
+        raise
+    finally:
+        e.shutdown()
+    if failures:
+        raise JobsFailed(failures, results) from failures[0].error
+    if waiting:
+        raise RuntimeError(f"Unresolved job dependencies: {[j.name for j in waiting]}")
+    return results
+
+
+def shard_of(key: str, shards: int) -> int:
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards + 1
+
+
+def select_shard(keys: Iterable[str], shard: int, shards: int) -> Set[str]:
+    # The assignment depends on nothing but the key, so shards running on different machines
+    # agree even when their stats files differ.
+    return {k for k in keys if shard_of(k, shards) == shard}
+
+
+def units_digest(keys: Iterable[str]) -> str:
+    ordered = sorted(keys)
+    sha = hashlib.sha256("\n".join(ordered).encode("utf-8")).hexdigest()
+    return f"{len(ordered)}:{sha}"
+
+
+def critical_path(results: List[JobResult]) -> List[JobResult]:
+    workers: Dict[str, List[JobResult]] = {}
+    for r in results:
+        workers.setdefault(r.worker, []).append(r)
+    if not workers:
+        return []
+    path = max(workers.values(), key=lambda rs: max(r.end for r in rs))
+    return sorted(path, key=lambda r: r.start)
+
+
+def format_critical_path(results: List[JobResult]) -> str:
+    path = critical_path(results)
+    if not path:
+        return "critical path: no jobs"
+    start = min(r.start for r in results)
+    lines = [f"critical path: {path[-1].end - start:.2f}s on {path[0].worker}"]
+    for r in path:
+        lines.append(f"  {r.duration:8.2f}s {r.job.name}")
+    return "\n".join(lines)
@@ -1,10 +1,11 @@
-from google.cloud.secretmanager import SecretManagerServiceClient
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 
 class SecretManagerClient:
     def __init__(self) -> None:
         super(SecretManagerClient, self).__init__()
+        from google.cloud.secretmanager import SecretManagerServiceClient
+
         self._client = SecretManagerServiceClient()
 
     @retry(stop=stop_after_attempt(5), wait=wait_exponential(), reraise=True)
@@ -5,10 +5,7 @@ import os
 import textwrap
 from typing import Optional
 
-import slack_sdk
 from dataplatform_kubernetes import LOGGER
-from dataplatform_kubernetes.secretmanager import SecretManagerClient
-from slack_sdk.errors import SlackApiError
 
 
 def post_to_slack(
@@ -35,6 +32,9 @@ def post_to_slack(
     else:
         params.update({"channel": "#mp-alert-datapf-dev"})
         secret_name = "projects/518261476924/secrets/slack-api-token/versions/latest"
+    import slack_sdk
+    from slack_sdk.errors import SlackApiError
+
     client = slack_sdk.WebClient(token=get_gcp_secret(secret_name))
     try:
         LOGGER.info(params)
@@ -79,5 +79,7 @@ def format_message_attachment(project: str, env: str, title: str, color: str, me
 
 
 def get_gcp_secret(secret_name: str) -> str:
+    from dataplatform_kubernetes.secretmanager import SecretManagerClient
+
     client = SecretManagerClient()
     return client.get_secret(secret_name)
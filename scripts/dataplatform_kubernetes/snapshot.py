@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+from dataplatform_kubernetes import (
+    BASE_DIR,
+    CUE_DELIVERY_FILE,
+    CUE_MANIFESTS_DIR,
+    CUE_PKG_DIR,
+)
+
+CUE_FILE_SUFFIX = ".cue"
+AVDL_FILE_SUFFIX = ".avdl"
+
+
+class RepositorySnapshot:
+    def __init__(self, roots: Iterable[Path]) -> None:
+        self.roots = [r.resolve() for r in roots]
+        self.cue_files: Dict[Path, List[str]] = {}
+        self.avdl_files: Dict[Path, List[str]] = {}
+        self.children: Dict[Path, List[Path]] = {}
+        self._ancestors: Dict[Path, List[Path]] = {}
+
+    @staticmethod
+    def build(roots: Iterable[Path]) -> "RepositorySnapshot":
+        snapshot = RepositorySnapshot(roots)
+        for root in snapshot.roots:
+            if root.is_dir():
+                snapshot._scan(root)
+        return snapshot
+
+    def _scan(self, root: Path) -> None:
+        stack = [root]
+        while stack:
+            dir = stack.pop()
+            children = []
+            cue_files = []
+            avdl_files = []
+            with os.scandir(dir) as entries:
+                for e in entries:
+                    if e.is_dir(follow_symlinks=False):
+                        children.append(dir / e.name)
+                    elif e.name.endswith(CUE_FILE_SUFFIX):
+                        cue_files.append(e.name)
+                    elif e.name.endswith(AVDL_FILE_SUFFIX):
+                        avdl_files.append(e.name)
+            self.children[dir] = sorted(children)
+            if cue_files:
+                self.cue_files[dir] = sorted(cue_files)
+            if avdl_files:
+                self.avdl_files[dir] = sorted(avdl_files)
+            stack.extend(children)
+
+    def covers(self, dir: Path) -> bool:
+        return any(r == dir or r in dir.parents for r in self.roots)
+
+    def walk(self, dir: Path) -> Iterator[Path]:
+        stack = [dir.resolve()]
+        while stack:
+            d = stack.pop()
+            yield d
+            stack.extend(self.children.get(d, []))
+
+    def cue_file_paths(self, dir: Path) -> List[Path]:
+        dir = dir.resolve()
+        if not self.covers(dir):
+            return sorted(dir.glob(f"*{CUE_FILE_SUFFIX}"))
+        return [dir / f for f in self.cue_files.get(dir, [])]
+
+    def delivery_dirs_under(self, dir: Path) -> List[Path]:
+        return [d for d in self.walk(dir) if CUE_DELIVERY_FILE in self.cue_files.get(d, [])]
+
+    def avdl_files_under(self, dir: Path) -> List[Path]:
+        return [d / f for d in self.walk(dir) for f in self.avdl_files.get(d, [])]
+
+    def ancestor_cue_dirs(self, dir: Path) -> List[Path]:
+        # Directories with cue files from dir up to, but excluding, the repository root.
+        dir = dir.resolve()
+        ancestors = self._ancestors.get(dir)
+        if ancestors is None:
+            if dir == BASE_DIR or BASE_DIR not in dir.parents:
+                ancestors = []
+            else:
+                has_cue_files = bool(self.cue_file_paths(dir))
+                ancestors = ([dir] if has_cue_files else []) + self.ancestor_cue_dirs(dir.parent)
+            self._ancestors[dir] = ancestors
+        return ancestors
+
+
+@lru_cache(maxsize=None)
+def get_snapshot() -> RepositorySnapshot:
+    return RepositorySnapshot.build([CUE_MANIFESTS_DIR, CUE_PKG_DIR])
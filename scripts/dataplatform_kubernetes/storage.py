@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import quote
+
+import crcmod.predefined
+from dataplatform_kubernetes import LOGGER
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+GCS_SCHEME = "gs://"
+GCS_API_URL = "https://storage.googleapis.com/storage/v1"
+GCS_UPLOAD_URL = "https://storage.googleapis.com/upload/storage/v1"
+GCS_SCOPE = "https://www.googleapis.com/auth/devstorage.read_write"
+
+
+def _is_transient(e: BaseException) -> bool:
+    # HTTP errors carry the response, connection errors of requests are OSErrors.
+    response = getattr(e, "response", None)
+    if response is not None:
+        status: int = response.status_code
+        return status == 429 or status >= 500
+    return isinstance(e, OSError)
+
+
+gcs_retry = retry(
+    retry=retry_if_exception(_is_transient),
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(),
+    reraise=True,
+)
+
+
+def crc32c(file: Path) -> str:
+    crc = crcmod.predefined.Crc("crc-32c")
+    with file.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc.update(chunk)
+    # Same encoding as the crc32c attribute of GCS objects.
+    return base64.b64encode(struct.pack(">I", crc.crcValue)).decode("ascii")
+
+
+class ObjectStore(ABC):
+    @property
+    @abstractmethod
+    def url(self) -> str:
+        pass
+
+    @abstractmethod
+    def list(self) -> Dict[str, str]:
+        pass
+
+    @abstractmethod
+    def upload(self, source: Path, name: str) -> None:
+        pass
+
+
+class LocalObjectStore(ObjectStore):
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    @property
+    def url(self) -> str:
+        return str(self.root.resolve())
+
+    def list(self) -> Dict[str, str]:
+        objects = {}
+        if self.root.exists():
+            for dirpath, _, filenames in os.walk(self.root):
+                for f in filenames:
+                    file = Path(dirpath) / f
+                    objects[str(file.relative_to(self.root))] = crc32c(file)
+        return objects
+
+    def upload(self, source: Path, name: str) -> None:
+        target = self.root / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+
+class GcsObjectStore(ObjectStore):
+    def __init__(self, bucket: str, prefix: str) -> None:
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._local = threading.local()
+
+    @property
+    def url(self) -> str:
+        return f"{GCS_SCHEME}{self.bucket}/{self.prefix}"
+
+    def _session(self) -> Any:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import google.auth
+            from google.auth.transport.requests import AuthorizedSession
+
+            credentials, _ = google.auth.default(scopes=[GCS_SCOPE])
+            session = AuthorizedSession(credentials)
+            self._local.session = session
+        return session
+
+    def _object_name(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    @gcs_retry
+    def _list_page(self, params: Dict[str, str]) -> Dict[str, Any]:
+        resp = self._session().get(f"{GCS_API_URL}/b/{self.bucket}/o", params=params)
+        resp.raise_for_status()
+        page: Dict[str, Any] = resp.json()
+        return page
+
+    def _list_pages(self) -> Iterator[Dict[str, Any]]:
+        params = {"prefix": self._object_name(""), "fields": "items(name,crc32c),nextPageToken"}
+        while True:
+            page = self._list_page(params)
+            yield page
+            if "nextPageToken" not in page:
+                break
+            params["pageToken"] = page["nextPageToken"]
+
+    def list(self) -> Dict[str, str]:
+        objects = {}
+        prefix = self._object_name("")
+        for page in self._list_pages():
+            for item in page.get("items", []):
+                objects[item["name"][len(prefix) :]] = item["crc32c"]
+        return objects
+
+    @gcs_retry
+    def upload(self, source: Path, name: str) -> None:
+        object_name = quote(self._object_name(name), safe="")
+        with source.open("rb") as f:
+            resp = self._session().post(
+                f"{GCS_UPLOAD_URL}/b/{self.bucket}/o?uploadType=media&name={object_name}",
+                data=f,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+        resp.raise_for_status()
+
+
+def get_object_store(destination: str) -> ObjectStore:
+    if destination.startswith(GCS_SCHEME):
+        bucket, _, prefix = destination[len(GCS_SCHEME) :].partition("/")
+        return GcsObjectStore(bucket, prefix)
+    if destination.startswith("file://"):
+        destination = destination[len("file://") :]
+    return LocalObjectStore(Path(destination))
+
+
+class UploadLedger:
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self.checksums: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default_file(cache_dir: Path, store: ObjectStore) -> Path:
+        digest = hashlib.sha256(store.url.encode("utf-8")).hexdigest()[:16]
+        return cache_dir / f"{digest}.json"
+
+    def load(self) -> bool:
+        if not self.file.exists():
+            return False
+        try:
+            with self.file.open("rt", encoding="utf-8") as f:
+                self.checksums = dict(json.load(f))
+        except (ValueError, TypeError):
+            LOGGER.warning(f"Ignore broken upload ledger: {self.file}")
+            return False
+        return True
+
+    def get(self, name: str) -> Optional[str]:
+        return self.checksums.get(name)
+
+    def update(self, name: str, checksum: str) -> None:
+        with self._lock:
+            self.checksums[name] = checksum
+
+    def save(self) -> None:
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.file.with_suffix(".tmp")
+        with tmp.open("wt", encoding="utf-8") as f:
+            json.dump(self.checksums, f, indent=0, sort_keys=True)
+        os.replace(tmp, self.file)
@@ -1,23 +1,131 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import collections
+import filecmp
 import io
 import os
+import shlex
+import signal
 import subprocess
+import tempfile
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List, Optional, Set, Tuple
+from typing import Any, Deque, Iterable, List, Optional, Set, Tuple
 
 import click
-from dataplatform_kubernetes import AVRO_AVDL_FILE, BASE_DIR, CUE_DELIVERY_FILE
+from dataplatform_kubernetes import BASE_DIR, LOGGER
+from dataplatform_kubernetes.snapshot import get_snapshot
+
+OUTPUT_TAIL_LINES = 200
+OUTPUT_FILE_MODE = 0o644
+OUTPUT_NEW = "new"
+OUTPUT_CHANGED = "changed"
+OUTPUT_UNCHANGED = "unchanged"
+
+
+@dataclass
+class GitChanges:
+    changed: List[Path] = field(default_factory=list)
+    deleted: List[Path] = field(default_factory=list)
+
+
+@dataclass
+class CommandUsage:
+    commands: int = 0
+    cpu_time: float = 0.0
+    max_rss: int = 0
+
+
+class CommandError(RuntimeError):
+    def __init__(self, cmd: List[str], return_code: int, output: List[str]) -> None:
+        super().__init__(f"Return code: {return_code}.")
+        self.cmd = cmd
+        self.return_code = return_code
+        self.output = output
+
+
+_usage = threading.local()
+_processes: Set[subprocess.Popen] = set()  # type: ignore
+_processes_lock = threading.Lock()
+_cancelled = threading.Event()
+
+
+def start_command_usage() -> None:
+    _usage.value = CommandUsage()
+
+
+def stop_command_usage() -> CommandUsage:
+    usage: CommandUsage = getattr(_usage, "value", None) or CommandUsage()
+    _usage.value = None
+    return usage
+
+
+def _exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def reset_commands() -> None:
+    _cancelled.clear()
+
+
+def _terminate(proc: subprocess.Popen) -> None:  # type: ignore
+    # Commands lead their own process group, so this also reaches what they spawned (cue ->
+    # java, sh -c ...), which would otherwise keep the output pipe open.
+    LOGGER.debug(f"terminate: {proc.pid}")
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def terminate_commands() -> None:
+    # Refuse to start new commands and terminate the running ones.
+    with _processes_lock:
+        _cancelled.set()
+        processes = list(_processes)
+    for proc in processes:
+        _terminate(proc)
+
+
+def _popen(cmd: List[str], **kwargs: Any) -> subprocess.Popen:  # type: ignore
+    with _processes_lock:
+        if _cancelled.is_set():
+            raise RuntimeError("Cancelled.")
+        proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+        _processes.add(proc)
+    return proc
+
+
+def _wait(proc: subprocess.Popen) -> int:  # type: ignore
+    # os.wait4 reaps the child like Popen.wait() and also returns its resource usage.
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    finally:
+        with _processes_lock:
+            _processes.discard(proc)
+    proc.returncode = _exit_code(status)
+    usage = getattr(_usage, "value", None)
+    if usage is not None:
+        usage.commands += 1
+        usage.cpu_time += rusage.ru_utime + rusage.ru_stime
+        usage.max_rss = max(usage.max_rss, rusage.ru_maxrss)
+    return proc.returncode
+
+
+def format_command(cmd: List[str]) -> str:
+    return shlex.join(cmd)
 
 
 def exec_command(
-    cmd: str, cwd: Optional[str] = None, echo: bool = True, check_return_code: bool = True
+    cmd: List[str], cwd: Optional[str] = None, echo: bool = True, check_return_code: bool = True
 ) -> Tuple[List[str], int]:
     if echo:
-        click.echo(cmd)
-    proc = subprocess.Popen(
+        click.echo(format_command(cmd))
+    proc = _popen(
         cmd,
-        shell=True,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         bufsize=-1,
@@ -25,19 +133,108 @@ def exec_command(
         cwd=cwd,
     )
     lines = []
-    with io.open(proc.stdout.fileno(), closefd=False) as stream:  # type: ignore
-        for line in stream:
-            if echo:
-                click.echo(line.rstrip())
-            lines.append(line)
-    proc.wait()
-    return_code = proc.returncode
+    try:
+        with io.open(proc.stdout.fileno(), closefd=False) as stream:  # type: ignore
+            for line in stream:
+                if echo:
+                    click.echo(line.rstrip())
+                lines.append(line)
+    except BaseException:
+        # Outside the terminal's process group Ctrl+C no longer reaches the command itself.
+        _terminate(proc)
+        raise
+    return_code = _wait(proc)
     if check_return_code and return_code != 0:
-        click.echo("".join(lines))
-        raise RuntimeError(f"Return code: {return_code}.")
+        if echo:
+            click.echo("".join(lines))
+        raise CommandError(cmd, return_code, lines[-OUTPUT_TAIL_LINES:])
     return lines, return_code
 
 
+def create_temp_output(output: Path) -> Tuple[int, str]:
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=output.parent, prefix=f".{output.name}.", suffix=".tmp")
+    os.chmod(tmp, OUTPUT_FILE_MODE)
+    return fd, tmp
+
+
+def replace_if_changed(tmp: str, output: Path) -> str:
+    if not output.exists():
+        os.replace(tmp, output)
+        return OUTPUT_NEW
+    if filecmp.cmp(tmp, output, shallow=False):
+        # Leave identical files untouched so that their mtime does not change.
+        os.unlink(tmp)
+        return OUTPUT_UNCHANGED
+    os.replace(tmp, output)
+    return OUTPUT_CHANGED
+
+
+def write_if_changed(output: Path, contents: str) -> str:
+    fd, tmp = create_temp_output(output)
+    try:
+        with os.fdopen(fd, "wt", encoding="utf-8") as f:
+            f.write(contents)
+        return replace_if_changed(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def exec_command_to_file(
+    cmd: List[str], output: Path, cwd: Optional[str] = None, tail: int = OUTPUT_TAIL_LINES
+) -> str:
+    fd, tmp = create_temp_output(output)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            proc = _popen(
+                cmd,
+                stdout=f,
+                stderr=subprocess.PIPE,
+                env=os.environ,
+                cwd=cwd,
+            )
+            errors: Deque[str] = collections.deque(maxlen=tail)
+            try:
+                with io.open(proc.stderr.fileno(), closefd=False) as stream:  # type: ignore
+                    for line in stream:
+                        errors.append(line)
+            except BaseException:
+                _terminate(proc)
+                raise
+            _wait(proc)
+        if proc.returncode != 0:
+            raise CommandError(cmd, proc.returncode, list(errors))
+        return replace_if_changed(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def get_git_changes(since: str) -> GitChanges:
+    # -z keeps paths with spaces or non-ASCII characters unquoted.
+    cmd = ["git", "diff", "--name-status", "-z", "-M", f"{since}...HEAD"]
+    lines, _ = exec_command(cmd, cwd=str(BASE_DIR), echo=False)
+    fields = "".join(lines).split("\0")
+    changes = GitChanges()
+    i = 0
+    while i < len(fields) - 1:
+        status = fields[i]
+        if status[:1] in ("R", "C"):
+            old, new = fields[i + 1], fields[i + 2]
+            if status[:1] == "R":
+                changes.deleted.append(BASE_DIR / old)
+            changes.changed.append(BASE_DIR / new)
+            i += 3
+            continue
+        if status[:1] == "D":
+            changes.deleted.append(BASE_DIR / fields[i + 1])
+        else:
+            changes.changed.append(BASE_DIR / fields[i + 1])
+        i += 2
+    return changes
+
+
 def get_changed_dir(changed: Iterable[Path]) -> Set[Path]:
     changed_dir = set()
     for c in changed:
@@ -52,16 +249,16 @@ def get_changed_dir(changed: Iterable[Path]) -> Set[Path]:
 
 
 def get_changed_cue_dir(changed: Set[Path]) -> Set[Path]:
+    snapshot = get_snapshot()
     cue_dir = set()
     for i in changed:
-        for j in i.rglob(CUE_DELIVERY_FILE):
-            cue_dir.add(j.parent)
+        cue_dir.update(snapshot.delivery_dirs_under(i))
     return cue_dir
 
 
 def get_changed_avro_files(changed: Set[Path]):
+    snapshot = get_snapshot()
     avro_files = set()
     for i in changed:
-        for j in i.rglob(AVRO_AVDL_FILE):
-            avro_files.add(j)
+        avro_files.update(snapshot.avdl_files_under(i))
     return avro_files
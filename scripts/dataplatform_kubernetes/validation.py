@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import re
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
 
 
 def validate_service_id(ctx: Any, param: Any, value: Optional[str]) -> Optional[str]:
@@ -24,3 +24,14 @@ def validate_project_id(ctx: Any, param: Any, value: Optional[str]) -> Optional[
         return value
     else:
         raise ValueError("Invalid service id.")
+
+
+def validate_shard(ctx: Any, param: Any, value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not value:
+        return None
+
+    match = re.match(r"^([0-9]+)/([0-9]+)$", value)
+    if match and 1 <= int(match.group(1)) <= int(match.group(2)):
+        return int(match.group(1)), int(match.group(2))
+    else:
+        raise ValueError("Invalid shard, expected i/N with 1 <= i <= N.")
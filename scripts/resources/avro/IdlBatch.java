@@ -0,0 +1,30 @@
+import java.util.Arrays;
+import org.apache.avro.tool.IdlToSchemataTool;
+
+/**
+ * Runs avro-tools idl2schemata for every (idl_file, output_dir) pair in a single JVM.
+ *
+ * <p>Usage: java -cp avro-tools.jar IdlBatch.java IDL_FILE OUTPUT_DIR [IDL_FILE OUTPUT_DIR]...
+ */
+public class IdlBatch {
+  public static void main(String[] args) throws Exception {
+    if (args.length % 2 != 0) {
+      System.err.println("Arguments must be pairs of IDL_FILE OUTPUT_DIR.");
+      System.exit(2);
+    }
+    IdlToSchemataTool tool = new IdlToSchemataTool();
+    int failed = 0;
+    for (int i = 0; i < args.length; i += 2) {
+      System.out.println(args[i]);
+      try {
+        if (tool.run(System.in, System.out, System.err, Arrays.asList(args[i], args[i + 1])) != 0) {
+          failed++;
+        }
+      } catch (Exception e) {
+        System.err.println(args[i] + ": " + e);
+        failed++;
+      }
+    }
+    System.exit(failed == 0 ? 0 : 1);
+  }
+}
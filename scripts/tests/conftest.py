@@ -0,0 +1,17 @@
+import pytest
+from dataplatform_kubernetes import cache, deps, snapshot, util
+from dataplatform_kubernetes.snapshot import get_snapshot
+
+
+@pytest.fixture
+def base_dir(tmp_path, monkeypatch):
+    # A repository of its own, with manifests/, pkg/ and cue.mod/ under tmp_path.
+    base_dir = tmp_path.resolve()
+    for module in [cache, deps, snapshot, util]:
+        monkeypatch.setattr(module, "BASE_DIR", base_dir, raising=False)
+        monkeypatch.setattr(module, "CUE_MANIFESTS_DIR", base_dir / "manifests", raising=False)
+        monkeypatch.setattr(module, "CUE_PKG_DIR", base_dir / "pkg", raising=False)
+    monkeypatch.setattr(cache, "CUE_MODULE_DIR", base_dir / "cue.mod")
+    get_snapshot.cache_clear()
+    yield base_dir
+    get_snapshot.cache_clear()
@@ -0,0 +1,14 @@
+import pytest
+from dataplatform_kubernetes.benchmark import (
+    STARTUP_COMMANDS,
+    _forbidden_modules,
+    _measure_startup,
+)
+
+
+@pytest.mark.parametrize("args", STARTUP_COMMANDS.values(), ids=STARTUP_COMMANDS.keys())
+def test_startup_does_not_import_sdks(args):
+    _, modules = _measure_startup(args, repeat=1)
+
+    assert "dataplatform_kubernetes.cli" in modules
+    assert _forbidden_modules(modules) == []
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+from dataplatform_kubernetes import cache
+from dataplatform_kubernetes.cache import DumpCache, dump_cache_salt
+from dataplatform_kubernetes.snapshot import get_snapshot
+
+
+@pytest.fixture
+def delivery_dir(base_dir):
+    delivery_dir = base_dir / "manifests" / "svc" / "dev"
+    delivery_dir.mkdir(parents=True)
+    (delivery_dir / "delivery.cue").write_text("package svc\n")
+    return delivery_dir
+
+
+def dump(cache_, delivery_dir, text):
+    key = cache_.key([delivery_dir], [])
+    output = delivery_dir.with_name("dev.yaml")
+    output.write_text(text)
+    cache_.put(key, output)
+    output.unlink()
+    return key, output
+
+
+def test_hit(tmp_path, delivery_dir):
+    dump_cache = DumpCache(tmp_path / "cache", 1024)
+    key, output = dump(dump_cache, delivery_dir, "kind: A\n")
+
+    assert dump_cache.restore(dump_cache.key([delivery_dir], []), output) is not None
+    assert output.read_text() == "kind: A\n"
+    assert (dump_cache.hits, dump_cache.misses) == (1, 0)
+
+
+def test_miss(tmp_path, delivery_dir):
+    dump_cache = DumpCache(tmp_path / "cache", 1024)
+
+    assert dump_cache.restore(dump_cache.key([delivery_dir], []), tmp_path / "x.yaml") is None
+    assert (dump_cache.hits, dump_cache.misses) == (0, 1)
+
+
+def test_key_changes_with_cue_files(tmp_path, delivery_dir):
+    dump_cache = DumpCache(tmp_path / "cache", 1024)
+    key, _ = dump(dump_cache, delivery_dir, "kind: A\n")
+
+    (delivery_dir / "delivery.cue").write_text("package svc\n\nx: 1\n")
+    assert dump_cache.key([delivery_dir], []) != key
+    (delivery_dir / "delivery.cue").write_text("package svc\n")
+    assert dump_cache.key([delivery_dir], []) == key
+    (delivery_dir / "extra.cue").write_text("package svc\n")
+    get_snapshot.cache_clear()
+    assert dump_cache.key([delivery_dir], []) != key
+
+
+def test_salt_changes_with_cue_mod(base_dir, monkeypatch):
+    monkeypatch.setattr(cache, "get_cue_version", lambda: "cue version v0.5.0")
+    module = base_dir / "cue.mod" / "module.cue"
+    module.parent.mkdir()
+    module.write_text('module: "github.com/kouzoh/dataplatform-kubernetes"\n')
+    salt = dump_cache_salt()
+
+    vendored = base_dir / "cue.mod" / "gen" / "k8s.io" / "api" / "core" / "v1" / "types_go_gen.cue"
+    vendored.parent.mkdir(parents=True)
+    vendored.write_text("package v1\n")
+    assert dump_cache_salt() != salt
+    updated = dump_cache_salt()
+    vendored.write_text("package v1\n\n#Pod: {}\n")
+    assert dump_cache_salt() != updated
+
+
+def test_salt_changes_with_cue_version(base_dir, monkeypatch):
+    monkeypatch.setattr(cache, "get_cue_version", lambda: "cue version v0.5.0")
+    salt = dump_cache_salt()
+    monkeypatch.setattr(cache, "get_cue_version", lambda: "cue version v0.6.0")
+
+    assert dump_cache_salt() != salt
+
+
+def test_evict_least_recently_used(tmp_path, delivery_dir):
+    dump_cache = DumpCache(tmp_path / "cache", 10)
+    old, _ = dump(dump_cache, delivery_dir, "kind: Old\n")
+    (delivery_dir / "delivery.cue").write_text("package svc\n\nx: 1\n")
+    new, _ = dump(dump_cache, delivery_dir, "kind: New\n")
+    old_entry = dump_cache.get(old)
+    new_entry = dump_cache.get(new)
+    os.utime(old_entry, (old_entry.stat().st_atime, old_entry.stat().st_mtime - 10))
+
+    dump_cache.evict()
+
+    assert not old_entry.exists()
+    assert new_entry.exists()
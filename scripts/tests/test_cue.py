@@ -0,0 +1,86 @@
+import pytest
+from click.testing import CliRunner
+from dataplatform_kubernetes import cue as cue_module
+from dataplatform_kubernetes.cache import DumpCache
+from dataplatform_kubernetes.cue import cue
+from dataplatform_kubernetes.deps import DependencyIndex
+from dataplatform_kubernetes.scheduler import JobStats, units_digest
+
+UNITS = ["dump:manifests/a", "dump:manifests/b", "avro:manifests/c/x.avdl"]
+
+
+def write_shard(tmp_path, shard, units, total=UNITS):
+    output = tmp_path / f"{shard.replace('/', '-')}.out"
+    output.write_text(
+        f"cue_files={' '.join(u.split(':')[1] + '.yaml' for u in units)}\n"
+        f"shard={shard}\n"
+        f"shard_total={units_digest(total)}\n"
+        f"shard_units={' '.join(units)}\n"
+    )
+    return str(output)
+
+
+def test_merge(tmp_path):
+    outputs = [
+        write_shard(tmp_path, "1/2", UNITS[:2]),
+        write_shard(tmp_path, "2/2", UNITS[2:]),
+    ]
+
+    result = CliRunner().invoke(cue, ["merge", *outputs])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.split("\n")[0] == (
+        "cue_files=manifests/a.yaml manifests/b.yaml manifests/c/x.avdl.yaml"
+    )
+
+
+@pytest.mark.parametrize(
+    "shards",
+    [
+        # A shard is missing.
+        [("1/3", UNITS[:2]), ("3/3", UNITS[2:])],
+        # A job was dumped by no shard.
+        [("1/2", UNITS[:1]), ("2/2", UNITS[2:])],
+        # A job was dumped twice.
+        [("1/2", UNITS[:2]), ("2/2", UNITS[1:])],
+    ],
+)
+def test_merge_checks_coverage(tmp_path, shards):
+    outputs = [write_shard(tmp_path, s, units) for s, units in shards]
+
+    result = CliRunner().invoke(cue, ["merge", *outputs])
+
+    assert result.exit_code != 0
+    assert isinstance(result.exception, RuntimeError)
+
+
+def test_merge_rejects_different_jobs(tmp_path):
+    outputs = [
+        write_shard(tmp_path, "1/2", UNITS[:2]),
+        write_shard(tmp_path, "2/2", UNITS[2:], total=UNITS[1:]),
+    ]
+
+    result = CliRunner().invoke(cue, ["merge", *outputs])
+
+    assert isinstance(result.exception, RuntimeError)
+
+
+def test_rebuild_survives_planning_errors(tmp_path, monkeypatch):
+    def update(dirs):
+        raise FileNotFoundError("delivery.cue removed mid-edit")
+
+    index = DependencyIndex()
+    monkeypatch.setattr(index, "update", update)
+    monkeypatch.setattr(cue_module, "dump_cache_salt", lambda: "")
+    dump_cache = DumpCache(tmp_path / "cache", 1024)
+
+    cue_module._rebuild(
+        {tmp_path / "delivery.cue"},
+        index,
+        dump_cache,
+        JobStats(tmp_path / "stats.json"),
+        max_worker=1,
+        batch=False,
+        batch_size=50,
+        avro_tools="",
+    )
@@ -0,0 +1,76 @@
+import shutil
+
+import pytest
+from dataplatform_kubernetes import CUE_MODULE_PATH
+from dataplatform_kubernetes.deps import DependencyIndex, import_path_to_dir
+
+
+def write(base_dir, path, text):
+    file = base_dir / path
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(text)
+    return file
+
+
+@pytest.fixture
+def tree(base_dir):
+    write(base_dir, "pkg/base/base.cue", "package base\n")
+    write(base_dir, "pkg/lib/lib.cue", f'package lib\n\nimport "{CUE_MODULE_PATH}/pkg/base"\n')
+    write(
+        base_dir,
+        "manifests/a/delivery.cue",
+        f'package a\n\nimport (\n\t"{CUE_MODULE_PATH}/pkg/lib"\n)\n',
+    )
+    write(
+        base_dir,
+        "manifests/b/delivery.cue",
+        'package b\n\nimport corev1 "k8s.io/api/core/v1"\n\nx: corev1.#Pod\n',
+    )
+    write(base_dir, "manifests/c/delivery.cue", "package c\n")
+    write(base_dir, "cue.mod/gen/k8s.io/api/core/v1/types_go_gen.cue", "package v1\n")
+    return base_dir
+
+
+def test_affected_delivery_dirs_follows_transitive_importers(tree):
+    index = DependencyIndex.build()
+
+    assert index.affected_delivery_dirs([tree / "pkg/base/base.cue"]) == {tree / "manifests/a"}
+    assert index.affected_delivery_dirs([tree / "manifests/c/delivery.cue"]) == {
+        tree / "manifests/c"
+    }
+    assert index.dependency_dirs(tree / "manifests/a") == [
+        tree / "manifests/a",
+        tree / "pkg/lib",
+        tree / "pkg/base",
+    ]
+
+
+def test_affected_delivery_dirs_deleted_package(tree):
+    index = DependencyIndex.build()
+    deleted = tree / "pkg/lib/lib.cue"
+    shutil.rmtree(deleted.parent)
+
+    index.update([deleted.parent])
+
+    assert tree / "pkg/lib" not in index.packages
+    # manifests/a still imports the deleted package and fails to build, so it is dumped.
+    assert index.affected_delivery_dirs([deleted]) == {tree / "manifests/a"}
+
+
+def test_out_of_module_imports(tree):
+    index = DependencyIndex.build()
+
+    assert import_path_to_dir("k8s.io/api/core/v1") is None
+    assert import_path_to_dir(f"{CUE_MODULE_PATH}/pkg/lib:lib") == tree / "pkg/lib"
+    assert index.imports[tree / "manifests/b"] == set()
+    assert index.dependency_dirs(tree / "manifests/b") == [tree / "manifests/b"]
+
+
+def test_affected_delivery_dirs_ignores_files_outside_manifests_and_pkg(tree):
+    index = DependencyIndex.build()
+
+    assert index.affected_delivery_dirs([tree / "pyproject.toml"]) == set()
+    assert (
+        index.affected_delivery_dirs([tree / "cue.mod/gen/k8s.io/api/core/v1/types_go_gen.cue"])
+        == set()
+    )
@@ -0,0 +1,76 @@
+import json
+
+from dataplatform_kubernetes.manifest import (
+    resource_dir,
+    resource_index,
+    split_manifest,
+)
+
+MANIFEST = """apiVersion: v1
+kind: Namespace
+metadata:
+  name: ns
+---
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: a
+  namespace: ns
+data:
+  key: value
+"""
+
+
+def test_split_manifest(tmp_path):
+    manifest = tmp_path / "x.yaml"
+    manifest.write_text(MANIFEST)
+
+    changed = split_manifest(manifest)
+
+    output_dir = resource_dir(manifest)
+    assert sorted(changed) == sorted(
+        [
+            str(output_dir / "Namespace" / "_cluster" / "ns.yaml"),
+            str(output_dir / "ConfigMap" / "ns" / "a.yaml"),
+            str(resource_index(manifest)),
+        ]
+    )
+    index = json.loads(resource_index(manifest).read_text())
+    assert [(r["kind"], r["namespace"], r["name"]) for r in index["resources"]] == [
+        ("Namespace", "_cluster", "ns"),
+        ("ConfigMap", "ns", "a"),
+    ]
+
+
+def test_split_manifest_unchanged(tmp_path):
+    manifest = tmp_path / "x.yaml"
+    manifest.write_text(MANIFEST)
+    split_manifest(manifest)
+
+    assert split_manifest(manifest) == []
+
+
+def test_split_manifest_removes_stale_resources(tmp_path):
+    manifest = tmp_path / "x.yaml"
+    manifest.write_text(MANIFEST)
+    split_manifest(manifest)
+
+    manifest.write_text(MANIFEST.split("---\n")[0])
+    changed = split_manifest(manifest)
+
+    assert not (resource_dir(manifest) / "ConfigMap" / "ns" / "a.yaml").exists()
+    assert changed == [str(resource_index(manifest))]
+
+
+def test_split_manifest_skips_resources_without_name(tmp_path):
+    manifest = tmp_path / "x.yaml"
+    manifest.write_text(
+        MANIFEST
+        + "---\napiVersion: batch/v1\nkind: Job\nmetadata:\n  generateName: job-\n"
+        + "---\napiVersion: v1\nkind: ConfigMapList\nitems: []\n"
+    )
+
+    split_manifest(manifest)
+
+    index = json.loads(resource_index(manifest).read_text())
+    assert [r["name"] for r in index["resources"]] == ["ns", "a"]
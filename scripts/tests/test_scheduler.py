@@ -0,0 +1,73 @@
+import json
+import time
+
+import pytest
+from dataplatform_kubernetes.scheduler import (
+    Job,
+    JobsFailed,
+    JobStats,
+    run_jobs,
+    select_shard,
+    units_digest,
+)
+from dataplatform_kubernetes.util import exec_command
+
+KEYS = [f"dump:manifests/microservices/svc-{i}/dev/x" for i in range(100)]
+
+
+def test_select_shard_partitions_keys():
+    shards = [select_shard(KEYS, i, 4) for i in range(1, 5)]
+
+    assert sorted(k for s in shards for k in s) == sorted(KEYS)
+    assert all(s for s in shards)
+
+
+def test_select_shard_ignores_other_keys():
+    # A key keeps its shard whatever else is being dumped.
+    assert select_shard(KEYS, 2, 4) & set(KEYS[:10]) == select_shard(KEYS[:10], 2, 4)
+
+
+def test_units_digest_ignores_order():
+    assert units_digest(KEYS) == units_digest(reversed(KEYS))
+    assert units_digest(KEYS) != units_digest(KEYS[1:])
+
+
+def fail():
+    raise RuntimeError("boom")
+
+
+def test_run_jobs_fail_fast_terminates_grandchildren():
+    # The shell forks sleep, which keeps the output pipe open unless its group is signalled.
+    jobs = [
+        Job("sleep", exec_command, (["sh", "-c", "sleep 5; echo done"], None, False)),
+        Job("fail", fail),
+    ]
+    start = time.monotonic()
+
+    with pytest.raises(JobsFailed) as e:
+        run_jobs(jobs, max_worker=2)
+
+    assert time.monotonic() - start < 2
+    assert [r.job.name for r in e.value.failures] == ["fail"]
+
+
+def test_run_jobs_memory_budget_does_not_starve_heavy_jobs(tmp_path):
+    stats_file = tmp_path / "stats.json"
+    stats_file.write_text(
+        json.dumps(
+            {
+                "durations": {"light-1": 4.0, "heavy": 3.0, "light-2": 2.0, "light-3": 1.0},
+                "peak_rss_kb": {"light-1": 30, "heavy": 80, "light-2": 30, "light-3": 30},
+            }
+        )
+    )
+    started = []
+    jobs = [
+        Job(n, lambda n=n: started.append(n) or time.sleep(0.05))
+        for n in ["light-3", "light-2", "heavy", "light-1"]
+    ]
+
+    run_jobs(jobs, max_worker=4, stats=JobStats(stats_file), memory_budget=100)
+
+    # heavy does not fit next to light-1, and the lighter jobs queued behind it wait for it.
+    assert started == ["light-1", "heavy", "light-2", "light-3"]
@@ -0,0 +1,235 @@
+from datetime import datetime
+
+import pytest
+from dataplatform_kubernetes.bigquery import schema_history
+from dataplatform_kubernetes.bigquery.schema_history import (
+    HISTORY_COLUMNS,
+    SchemaHistory,
+    SchemaMigrationConfig,
+    created_table,
+    migration_targets,
+    not_found_table,
+    plan_migrations,
+)
+
+
+def migration(script, *queries):
+    return SchemaMigrationConfig(
+        script, datetime(2024, 1, 1), "", "", list(queries), ";\n".join(queries)
+    )
+
+
+def test_migration_targets():
+    m = migration(
+        "V1",
+        "-- add a column\nALTER TABLE `proj-x.ds_a.T1` ADD COLUMN x INT64",
+        "INSERT INTO ds_b.t2 WITH x AS (SELECT a FROM p.ds_c.src) SELECT * FROM x",
+        "CREATE OR REPLACE VIEW ds_d.v AS SELECT * FROM ds_b.t2 JOIN ds_e.t USING (a)",
+    )
+
+    assert migration_targets(m) == {"ds_a.t1", "ds_b.t2", "ds_c.src", "ds_d.v", "ds_e.t"}
+
+
+def test_migration_targets_merge_source():
+    m = migration("V1", "MERGE INTO ds.t USING ds.s ON t.a = s.a WHEN MATCHED THEN DELETE")
+
+    assert migration_targets(m) == {"ds.t", "ds.s"}
+
+
+def test_migration_targets_rename():
+    m = migration("V1", "ALTER TABLE proj.ds.old RENAME TO new_t")
+
+    assert migration_targets(m) == {"ds.old", "ds.new_t"}
+
+
+def test_migration_targets_unknown_statement():
+    m = migration("V1", "CREATE TABLE ds.t (a INT64)", "CREATE SCHEMA ds_z")
+
+    assert migration_targets(m) is None
+
+
+def test_plan_migrations():
+    migrations = [
+        migration("V1", "ALTER TABLE ds_a.t1 ADD COLUMN x INT64"),
+        migration("V2", "CREATE TABLE ds_b.t2 (a INT64)"),
+        migration("V3", "ALTER TABLE ds_a.t1 ADD COLUMN y INT64"),
+        migration("V4", "MERGE ds_c.t3 USING ds_b.t2 ON t3.a = t2.a WHEN MATCHED THEN DELETE"),
+        migration("V5", "ALTER TABLE ds_a.t1 RENAME TO t4"),
+        migration("V6", "ALTER TABLE ds_a.t4 ADD COLUMN z INT64"),
+        migration("V7", "DROP TABLE ds_e.t5"),
+    ]
+
+    assert plan_migrations(migrations) == {
+        "V1": [],
+        "V2": [],
+        "V3": ["V1"],
+        "V4": ["V2"],
+        "V5": ["V3"],
+        "V6": ["V5"],
+        "V7": [],
+    }
+
+
+def test_plan_migrations_barrier():
+    migrations = [
+        migration("V1", "ALTER TABLE ds_a.t1 ADD COLUMN x INT64"),
+        migration("V2", "ALTER TABLE ds_b.t2 ADD COLUMN x INT64"),
+        migration("V3", "CREATE SCHEMA ds_c"),
+        migration("V4", "CREATE TABLE ds_c.t3 (a INT64)"),
+        migration("V5", "ALTER TABLE ds_a.t1 ADD COLUMN y INT64"),
+    ]
+
+    assert plan_migrations(migrations) == {
+        "V1": [],
+        "V2": [],
+        "V3": ["V1", "V2"],
+        "V4": ["V3"],
+        "V5": ["V3"],
+    }
+
+
+def test_created_table():
+    assert created_table("CREATE TABLE IF NOT EXISTS `p.ds.t` (a INT64)") == "ds.t"
+    assert created_table("ALTER TABLE ds.old RENAME TO new_t") == "ds.new_t"
+    assert created_table("ALTER TABLE ds.t RENAME COLUMN a TO b") is None
+    assert created_table("INSERT INTO ds.t SELECT 1") is None
+
+
+def test_not_found_table():
+    error = "404 Not found: Table proj:ds.t was not found in location US"
+
+    assert not_found_table(error) == "ds.t"
+    assert not_found_table("400 Syntax error: Unexpected end of script") is None
+
+
+class History:
+    # SchemaHistory against an in-memory history table.
+    def __init__(self, tmp_path, monkeypatch, migrations, rows=(), checkpoint_interval=0):
+        monkeypatch.setattr(schema_history, "Client", lambda project: None)
+        monkeypatch.setattr(schema_history.slack, "post_to_slack", lambda **kwargs: None)
+        self.rows = list(rows)
+        self.inserts = []
+        self.applied = []
+        self.fail_insert = False
+        history = SchemaHistory(
+            env="dev",
+            dir=tmp_path,
+            parent_project="p",
+            project="p",
+            dataset="d",
+            table="schema_history",
+            checkpoint_interval=checkpoint_interval,
+            journal_dir=tmp_path / "journal",
+            create_history_table=False,
+        )
+        history.read_migration_config = lambda: migrations
+        history.load_schema_history = self.load
+        history.insert_schema_history_rows = self.insert
+        history._run_query = lambda query, dryrun=False: self.applied.append(query)
+        self.history = history
+
+    def load(self):
+        history = {}
+        for r in self.rows:
+            history.setdefault(r[1], []).append(dict(zip(HISTORY_COLUMNS, r)))
+        return history
+
+    def insert(self, rows):
+        if self.fail_insert:
+            raise RuntimeError("insert failed")
+        self.inserts.append([r[3] for r in rows])
+        self.rows.extend(rows)
+
+
+def versioned(*scripts):
+    migrations = []
+    for i, script in enumerate(scripts, start=1):
+        m = migration(script, f"ALTER TABLE ds.t{i} ADD COLUMN x INT64")
+        m.version = datetime(2024, 1, i)
+        migrations.append(m)
+    return migrations
+
+
+def ranks(rows):
+    return {r[3]: r[0] for r in rows}
+
+
+def test_migrate_assigns_ranks_in_version_order(tmp_path, monkeypatch):
+    migrations = versioned("V1", "V2", "V3")
+    installed = SchemaHistory.history_row(5, migrations[0], 0, True)
+    h = History(tmp_path, monkeypatch, migrations, rows=[installed])
+
+    h.history.migrate()
+
+    assert h.applied == [m.queries[0] for m in migrations[1:]]
+    # One insert for the whole run.
+    assert h.inserts == [["V2", "V3"]]
+    assert ranks(h.rows) == {"V1": 5, "V2": 6, "V3": 7}
+    assert h.history.journal.read() == []
+
+
+def test_migrate_recovers_journal_of_failed_run(tmp_path, monkeypatch):
+    migrations = versioned("V1", "V2", "V3")
+    failed = History(tmp_path, monkeypatch, migrations[:2])
+    failed.fail_insert = True
+    with pytest.raises(RuntimeError):
+        failed.history.migrate()
+    assert [r[3] for r in failed.history.journal.read()] == ["V1", "V2"]
+
+    h = History(tmp_path, monkeypatch, migrations)
+    h.history.migrate()
+
+    # V1 and V2 are recorded from the journal and not applied again.
+    assert h.applied == [migrations[2].queries[0]]
+    assert h.inserts == [["V1", "V2"], ["V3"]]
+    assert ranks(h.rows) == {"V1": 1, "V2": 2, "V3": 3}
+    assert h.history.journal.read() == []
+
+
+def test_recover_schema_history_skips_written_rows(tmp_path, monkeypatch):
+    migrations = versioned("V1", "V2")
+    rows = [SchemaHistory.history_row(i, m, 0, True) for i, m in enumerate(migrations, start=1)]
+    # The crashed run wrote V1 before it stopped.
+    h = History(tmp_path, monkeypatch, migrations, rows=rows[:1])
+    for r in rows:
+        h.history.journal.append(r)
+    history = h.load()
+
+    h.history._recover_schema_history(history)
+
+    assert h.inserts == [["V2"]]
+    assert sorted(history) == sorted(r[1] for r in rows)
+    assert h.history.journal.read() == []
+
+
+def test_checkpoint_interval(tmp_path, monkeypatch):
+    migrations = versioned("V1", "V2", "V3")
+    h = History(tmp_path, monkeypatch, migrations, checkpoint_interval=2)
+
+    h.history.migrate()
+
+    assert h.inserts == [["V1", "V2"], ["V3"]]
+
+
+class MissingTableClient:
+    def get_table(self, table):
+        raise schema_history.NotFound(f"Not found: Table {table}")
+
+
+def test_pending_migrations_without_history_table(tmp_path, monkeypatch):
+    migrations = versioned("V1", "V2")
+    h = History(tmp_path, monkeypatch, migrations)
+    h.history._client = MissingTableClient()
+    h.history.load_schema_history = lambda: pytest.fail("history table queried")
+
+    assert h.history.pending_migrations() == migrations
+
+
+def test_pending_migrations_excludes_journal(tmp_path, monkeypatch):
+    migrations = versioned("V1", "V2", "V3")
+    h = History(tmp_path, monkeypatch, migrations)
+    h.history._client = type("Client", (), {"get_table": lambda self, table: None})()
+    h.rows.append(SchemaHistory.history_row(1, migrations[0], 0, True))
+    h.history.journal.append(SchemaHistory.history_row(2, migrations[1], 0, True))
+
+    assert h.history.pending_migrations() == migrations[2:]
@@ -0,0 +1,88 @@
+import os
+
+from dataplatform_kubernetes import snapshot
+from dataplatform_kubernetes.snapshot import get_snapshot
+
+
+def write(base_dir, path, text=""):
+    file = base_dir / path
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(text)
+
+
+def tree(base_dir):
+    write(base_dir, "manifests/common.cue")
+    write(base_dir, "manifests/svc/dev/delivery.cue")
+    write(base_dir, "manifests/svc/dev/schema/event.avdl")
+    write(base_dir, "manifests/svc/prod/delivery.cue")
+    write(base_dir, "manifests/svc/prod/README.md")
+    write(base_dir, "pkg/lib/lib.cue")
+
+
+def test_snapshot_walks_each_dir_once(base_dir, monkeypatch):
+    tree(base_dir)
+    scanned = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scanned.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(snapshot.os, "scandir", counting_scandir)
+
+    s = get_snapshot()
+    s.delivery_dirs_under(base_dir / "manifests")
+    s.avdl_files_under(base_dir / "manifests")
+    s.cue_file_paths(base_dir / "manifests/svc/dev")
+    s.ancestor_cue_dirs(base_dir / "manifests/svc/dev")
+
+    assert sorted(scanned) == sorted(
+        base_dir / d
+        for d in [
+            "manifests",
+            "manifests/svc",
+            "manifests/svc/dev",
+            "manifests/svc/dev/schema",
+            "manifests/svc/prod",
+            "pkg",
+            "pkg/lib",
+        ]
+    )
+
+
+def test_snapshot_queries(base_dir):
+    tree(base_dir)
+    s = get_snapshot()
+
+    assert sorted(s.delivery_dirs_under(base_dir / "manifests")) == [
+        base_dir / "manifests/svc/dev",
+        base_dir / "manifests/svc/prod",
+    ]
+    assert s.avdl_files_under(base_dir / "manifests/svc") == [
+        base_dir / "manifests/svc/dev/schema/event.avdl"
+    ]
+    assert s.cue_file_paths(base_dir / "manifests/svc/prod") == [
+        base_dir / "manifests/svc/prod/delivery.cue"
+    ]
+    assert s.ancestor_cue_dirs(base_dir / "manifests/svc/dev/schema") == [
+        base_dir / "manifests/svc/dev",
+        base_dir / "manifests",
+    ]
+
+
+def test_get_snapshot_cache_clear(base_dir):
+    tree(base_dir)
+    assert get_snapshot() is get_snapshot()
+    before = get_snapshot()
+
+    write(base_dir, "manifests/svc/stg/delivery.cue")
+
+    # The snapshot is taken once per process until watch clears it before a rebuild.
+    assert base_dir / "manifests/svc/stg" not in get_snapshot().delivery_dirs_under(
+        base_dir / "manifests"
+    )
+    get_snapshot.cache_clear()
+    assert get_snapshot() is not before
+    assert base_dir / "manifests/svc/stg" in get_snapshot().delivery_dirs_under(
+        base_dir / "manifests"
+    )
@@ -0,0 +1,76 @@
+import pytest
+from dataplatform_kubernetes.storage import GcsObjectStore
+
+
+class Response:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            error = RuntimeError(f"HTTP {self.status_code}")
+            error.response = self
+            raise error
+
+    def json(self):
+        return self.data
+
+
+class Session:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def get(self, url, params):
+        return self._next()
+
+    def post(self, url, data, headers):
+        return self._next()
+
+
+@pytest.fixture(autouse=True)
+def no_wait(monkeypatch):
+    monkeypatch.setattr(GcsObjectStore.upload.retry, "sleep", lambda _: None)
+    monkeypatch.setattr(GcsObjectStore._list_page.retry, "sleep", lambda _: None)
+
+
+def store(session):
+    store = GcsObjectStore("bucket", "branches/x/manifests")
+    store._local.session = session
+    return store
+
+
+def test_list_retries_transient_errors():
+    items = {"items": [{"name": "branches/x/manifests/a.yaml", "crc32c": "AAAAAA=="}]}
+    session = Session([ConnectionError("reset"), Response(503), Response(200, items)])
+
+    assert store(session).list() == {"a.yaml": "AAAAAA=="}
+    assert session.calls == 3
+
+
+def test_upload_retries_transient_errors(tmp_path):
+    source = tmp_path / "a.yaml"
+    source.write_text("a")
+    session = Session([Response(429), Response(200)])
+
+    store(session).upload(source, "a.yaml")
+
+    assert session.calls == 2
+
+
+def test_upload_does_not_retry_client_errors(tmp_path):
+    source = tmp_path / "a.yaml"
+    source.write_text("a")
+    session = Session([Response(403), Response(200)])
+
+    with pytest.raises(RuntimeError):
+        store(session).upload(source, "a.yaml")
+    assert session.calls == 1
@@ -0,0 +1,54 @@
+import subprocess
+
+from dataplatform_kubernetes.util import get_git_changes
+
+
+def git(base_dir, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=base_dir,
+        check=True,
+        capture_output=True,
+    )
+
+
+def write(base_dir, path, text):
+    file = base_dir / path
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(text)
+
+
+def test_get_git_changes(base_dir):
+    git(base_dir, "init", "-q")
+    write(base_dir, "manifests/a/delivery.cue", "package a\n")
+    write(base_dir, "manifests/with space/delivery.cue", "package b\n")
+    write(base_dir, "manifests/old/delivery.cue", "package old\n\nx: 1\ny: 2\nz: 3\n")
+    write(base_dir, "manifests/gone/delivery.cue", "package gone\n")
+    git(base_dir, "add", ".")
+    git(base_dir, "commit", "-q", "-m", "base")
+    git(base_dir, "tag", "base")
+
+    write(base_dir, "manifests/a/delivery.cue", "package a\n\nx: 1\n")
+    write(base_dir, "manifests/with space/delivery.cue", "package b\n\nx: 1\n")
+    git(base_dir, "mv", "manifests/old", "manifests/new dir")
+    git(base_dir, "rm", "-q", "manifests/gone/delivery.cue")
+    write(base_dir, "manifests/ü/delivery.cue", "package u\n")
+    git(base_dir, "add", ".")
+    git(base_dir, "commit", "-q", "-m", "change")
+
+    changes = get_git_changes("base")
+
+    assert sorted(changes.changed) == sorted(
+        [
+            base_dir / "manifests/a/delivery.cue",
+            base_dir / "manifests/new dir/delivery.cue",
+            base_dir / "manifests/with space/delivery.cue",
+            base_dir / "manifests/ü/delivery.cue",
+        ]
+    )
+    assert sorted(changes.deleted) == sorted(
+        [
+            base_dir / "manifests/gone/delivery.cue",
+            base_dir / "manifests/old/delivery.cue",
+        ]
+    )